@@ -0,0 +1,251 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.asr.whisper_asr import ASREngine, StreamingTranscriber
+from app.pipeline.event_queue import EventQueue, release_event
+from app.utils.cancel import CancelToken
+from app.utils.time import now_ms
+
+class ASRService:
+    """
+    Runs ASR on a dedicated worker thread behind a request/future API.
+
+    submit() takes an audio event and returns a Future. The audio is handed over as the
+    segment lease itself, so the worker reads the float32 view straight out of the
+    capture ring (memory shared between threads, nothing is copied) and releases it
+    when the request completes. Pending requests sit in a coalescing EventQueue, so a
+    newer partial supersedes an older one and its Future is cancelled.
+    Requests that arrive within `batch_window_ms` of each other are decoded together
+    through ASREngine.transcribe_batch. Results resolve the Future and are posted to
+    `out_q`.
+
+    With a `draft_asr`, partials go to that (smaller) model and finals to `asr`; finals
+    are then decoded in full rather than reusing the draft tier's committed prefix.
+
+    Each request carries a CancelToken. Submitting a final cancels the partials of the
+    same utterance that are still queued or being decoded.
+
+    submit() is called from the UI thread and never waits: a "block" policy is applied
+    as "drop_oldest" to the request queue.
+    """
+    def __init__(self, asr: ASREngine, stream_asr: Optional[StreamingTranscriber] = None,
+                 out_q: Optional[queue.Queue] = None, max_pending: int = 16, policy: str = "drop_oldest",
+                 batch_window_ms: int = 30, max_batch: int = 4, draft_asr: Optional[ASREngine] = None):
+        self.asr = asr
+        self.draft_asr = draft_asr
+        self.stream_asr = stream_asr
+        self.out_q = out_q
+        self.batch_window_ms = max(0, batch_window_ms)
+        self.max_batch = max(1, max_batch)
+
+        if policy == "block":
+            policy = "drop_oldest"
+        self.requests = EventQueue(max_pending, policy, on_discard=self._discard)
+        self.running = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._lock = threading.Lock()
+        self._partial_tokens: Dict[Tuple[Any, Any], List[CancelToken]] = {}
+        self.in_flight = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.batches = 0
+        self.latencies_ms = deque(maxlen=100)  # submit -> result
+        self.decode_ms = deque(maxlen=100)     # time spent in the model
+        self.tier_audio_s = {"draft": 0.0, "final": 0.0}
+        self.tier_decode_s = {"draft": 0.0, "final": 0.0}
+
+    def start(self):
+        self.running.set()
+        self._thread = threading.Thread(target=self._run, name="asr-service", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running.clear()
+        self.requests.clear()
+
+    def submit(self, ev: Dict[str, Any]) -> Future:
+        fut: Future = Future()
+        ev["future"] = fut
+        ev["submit_t"] = time.perf_counter()
+        ev["cancel"] = token = CancelToken()
+        key = (ev.get("source"), ev.get("utt"))
+        with self._lock:
+            self.in_flight += 1
+            if ev.get("kind") == "partial":
+                self._partial_tokens.setdefault(key, []).append(token)
+            else:
+                for stale in self._partial_tokens.pop(key, []):
+                    stale.cancel()
+        self.requests.put(ev, block=False)
+        return fut
+
+    def _forget_token(self, ev: Dict[str, Any]):
+        key = (ev.get("source"), ev.get("utt"))
+        tokens = self._partial_tokens.get(key)
+        if tokens and ev.get("cancel") in tokens:
+            tokens.remove(ev["cancel"])
+            if not tokens:
+                del self._partial_tokens[key]
+
+    def _discard(self, ev: Dict[str, Any]):
+        release_event(ev)
+        fut = ev.get("future")
+        if fut is not None and fut.cancel():
+            with self._lock:
+                self._forget_token(ev)
+                self.in_flight -= 1
+                self.cancelled += 1
+
+    def _run(self):
+        while self.running.is_set():
+            try:
+                ev = self.requests.get(timeout=0.2)
+            except queue.Empty:
+                continue
+
+            # group segments that become ready together (e.g. both speakers at once);
+            # streaming/draft partials are decoded alone, so they go out right away
+            batch = [ev]
+            deadline = time.perf_counter() + self.batch_window_ms / 1000.0
+            while len(batch) < self.max_batch and self._batchable(ev):
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process_batch(batch)
+
+    def _batchable(self, ev: Dict[str, Any]) -> bool:
+        return ev.get("kind") != "partial" or (self.draft_asr is None and self.stream_asr is None)
+
+    def _process_batch(self, batch: List[Dict[str, Any]]):
+        live = []
+        for ev in batch:
+            if ev["future"].set_running_or_notify_cancel():
+                live.append(ev)
+            else:
+                release_event(ev)
+        if not live:
+            return
+        if len(live) > 1:
+            self.batches += 1
+
+        t0 = time.perf_counter()
+        # (event, committed prefix, tail audio to decode, prompt)
+        plain: List[Tuple[Dict[str, Any], str, Any, Optional[str]]] = []
+        drafts: List[Tuple[Dict[str, Any], Any]] = []
+        for ev in live:
+            seg = ev.get("segment")
+            audio = seg.audio() if seg is not None else None
+            key = (ev.get("source"), ev.get("utt"))
+            if audio is None or not audio.size:
+                self._finish(ev, "", t0)
+            elif ev["cancel"].cancelled:
+                (self.draft_asr or self.asr)._note_cancel(audio.shape[0])
+                self._finish(ev, "", t0)
+            elif not self._batchable(ev):
+                drafts.append((ev, audio))
+            elif self.stream_asr is None:
+                plain.append((ev, "", audio, None))
+            elif self.draft_asr is not None:
+                # two tiers: the final model decodes the whole segment
+                self.stream_asr.reset(key)
+                plain.append((ev, "", audio, None))
+            else:
+                prefix, tail, prompt = self.stream_asr.prepare_final(key, audio)
+                if tail is None:
+                    self._finish(ev, prefix, t0)
+                else:
+                    plain.append((ev, prefix, tail, prompt))
+
+        for ev, audio in drafts:
+            td = time.perf_counter()
+            if self.stream_asr is not None:
+                # streaming partials need word timestamps: decoded on their own
+                before = self.stream_asr.decoded_samples
+                text = self._safe(self.stream_asr.partial, (ev.get("source"), ev.get("utt")), audio, ev["cancel"])
+                n = self.stream_asr.decoded_samples - before
+            else:
+                text = self._safe(self.draft_asr.transcribe, audio, None, ev["cancel"])
+                n = audio.shape[0]
+            self._account("draft", n, time.perf_counter() - td)
+            self._finish(ev, text, t0)
+
+        if plain:
+            td = time.perf_counter()
+            try:
+                texts = self.asr.transcribe_batch([p[2] for p in plain], [p[3] for p in plain])
+            except Exception:
+                texts = [""] * len(plain)
+            only_partials = all(p[0].get("kind") == "partial" for p in plain)
+            tier = "draft" if self.draft_asr is None and only_partials else "final"
+            self._account(tier, sum(p[2].shape[0] for p in plain), time.perf_counter() - td)
+            for (ev, prefix, _tail, _prompt), text in zip(plain, texts):
+                self._finish(ev, " ".join([prefix, text]).strip(), t0)
+
+    def _account(self, tier: str, samples: int, seconds: float):
+        with self._lock:
+            self.tier_audio_s[tier] += samples / 16000.0
+            self.tier_decode_s[tier] += seconds
+
+    @staticmethod
+    def _safe(fn, *args) -> str:
+        try:
+            return fn(*args)
+        except Exception:
+            return ""
+
+    def _finish(self, ev: Dict[str, Any], text: str, t0: float):
+        release_event(ev)
+        t1 = time.perf_counter()
+        res = {
+            "type": "asr",
+            "source": ev.get("source"),
+            "kind": ev.get("kind"),
+            "utt": ev.get("utt"),
+            "text": "" if ev["cancel"].cancelled else text,
+            "cancelled": ev["cancel"].cancelled,
+            "audio_ms": ev.get("ms"),
+            "decode_ms": (t1 - t0) * 1000.0,
+            "latency_ms": (t1 - ev["submit_t"]) * 1000.0,
+            "t": now_ms(),
+        }
+        with self._lock:
+            self._forget_token(ev)
+            self.in_flight -= 1
+            self.completed += 1
+            self.latencies_ms.append(res["latency_ms"])
+            self.decode_ms.append(res["decode_ms"])
+
+        ev["future"].set_result(res)
+        if self.out_q is not None:
+            self.out_q.put(res)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = list(self.latencies_ms)
+            dec = list(self.decode_ms)
+            return {
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "batches": self.batches,
+                "last_latency_ms": lat[-1] if lat else 0.0,
+                "avg_latency_ms": sum(lat) / len(lat) if lat else 0.0,
+                "avg_decode_ms": sum(dec) / len(dec) if dec else 0.0,
+                "rtf": {t: (self.tier_decode_s[t] / self.tier_audio_s[t]) if self.tier_audio_s[t] else 0.0
+                        for t in self.tier_audio_s},
+                "cancel_saved": {
+                    "final": self.asr.cancel_stats.as_dict(),
+                    "draft": self.draft_asr.cancel_stats.as_dict() if self.draft_asr is not None else {},
+                },
+                "queue": self.requests.stats(),
+                "streaming": self.stream_asr.stats() if self.stream_asr is not None else {},
+            }
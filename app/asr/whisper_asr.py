@@ -1,20 +1,32 @@
-from typing import Optional
+from typing import Any, Dict, Hashable, List, Optional, Tuple
 import numpy as np
 import os
 import sys
+import time
 from pathlib import Path
 
+from app.utils.cancel import CancelStats, CancelToken
+
 try:
     from faster_whisper import WhisperModel
 except Exception:
     WhisperModel = None
 
 class ASREngine:
-    def __init__(self, model_size: str = "Systran/faster-whisper-tiny.en", compute_type: str = "int8"):
+    N_SAMPLES = 16000 * 30  # Whisper window
+    N_FRAMES = 3000
+    MAX_NEW_TOKENS = 224
+
+    def __init__(self, model_size: str = "Systran/faster-whisper-tiny.en", compute_type: str = "int8", cpu_threads: int = 0):
         self.model_size = model_size
         self.compute_type = compute_type
+        self.cpu_threads = cpu_threads  # 0 = all available cores
         self.model = None
         self.ready = False
+        self._tokenizer = None
+        self._batch_ok = True
+        self.rtf = 0.25  # running estimate, used to price cancelled work
+        self.cancel_stats = CancelStats()
         self._init()
 
     def _resolve_model_path(self, model_size: str) -> str:
@@ -53,8 +65,8 @@ class ASREngine:
             # Resolve model path (local or HuggingFace)
             model_path = self._resolve_model_path(self.model_size)
             
-            # Optimize for speed: use available CPU threads
-            cpu_threads = os.cpu_count() or 4
+            # Optimize for speed: use available CPU threads unless a budget was given
+            cpu_threads = self.cpu_threads or os.cpu_count() or 4
             
             print(f"Loading ASR model: {model_path}", file=sys.stderr)
             
@@ -62,7 +74,7 @@ class ASREngine:
                 model_path, 
                 device="cpu", 
                 compute_type=self.compute_type,
-                cpu_threads=cpu_threads,  # Use all available CPU threads
+                cpu_threads=cpu_threads,
                 num_workers=1             # Single worker for low latency
             )
             self.ready = True
@@ -81,22 +93,234 @@ class ASREngine:
             
             self.ready = False
 
-    def transcribe(self, audio_f32: np.ndarray) -> str:
+    def _decode(self, audio_f32: np.ndarray, initial_prompt: Optional[str] = None, word_timestamps: bool = False):
+        segments, _ = self.model.transcribe(
+            audio_f32,
+            language="en",
+            vad_filter=False,
+            beam_size=1,
+            best_of=1,                      # Only use 1 candidate (faster)
+            temperature=0.0,                # Greedy sampling (fastest, deterministic)
+            condition_on_previous_text=False,  # No context dependency (faster)
+            initial_prompt=initial_prompt or None,
+            without_timestamps=not word_timestamps,  # Skip timestamp generation (faster)
+            word_timestamps=word_timestamps,
+            log_progress=False              # No progress logging (faster)
+        )
+        return segments
+
+    def _note_rtf(self, samples: int, seconds: float):
+        if samples > 0:
+            self.rtf = 0.8 * self.rtf + 0.2 * (seconds * 16000.0 / samples)
+
+    def _note_cancel(self, samples_left: int):
+        self.cancel_stats.record(samples_left / 16000.0 * self.rtf * 1000.0)
+
+    def _note_cancel_mid(self, samples: int, seg_end_s: float):
+        # faster-whisper decodes a whole 30 s window before yielding its segments: only
+        # the windows after the current one are actually skipped (none for short segments)
+        window_end = (int(seg_end_s * 16000) // self.N_SAMPLES + 1) * self.N_SAMPLES
+        self._note_cancel(max(0, samples - window_end))
+
+    def transcribe(self, audio_f32: np.ndarray, initial_prompt: Optional[str] = None,
+                   cancel: Optional[CancelToken] = None) -> str:
+        """
+        `cancel` is checked before decoding and between Whisper segments. Segments arrive
+        per 30 s window, so for short audio only the check before decoding saves work.
+        """
         if not self.ready or self.model is None:
             return ""
+        if cancel is not None and cancel.cancelled:
+            self._note_cancel(audio_f32.shape[0])
+            return ""
+        try:
+            t0 = time.perf_counter()
+            parts = []
+            for seg in self._decode(audio_f32, initial_prompt):
+                if cancel is not None and cancel.cancelled:
+                    self._note_cancel_mid(audio_f32.shape[0], seg.end)
+                    return ""
+                parts.append(seg.text.strip())
+            self._note_rtf(audio_f32.shape[0], time.perf_counter() - t0)
+            return " ".join(parts).strip()
+        except Exception:
+            return ""
+
+    def transcribe_batch(self, audios: List[np.ndarray], initial_prompts: Optional[List[Optional[str]]] = None) -> List[str]:
+        """
+        Transcribe several short segments (<= 30 s each) in a single batched encoder and
+        decoder pass, e.g. a mic and a loopback segment that became ready together.
+        Falls back to one-by-one transcription if the batched path is unavailable.
+        """
+        prompts = initial_prompts or [None] * len(audios)
+        if not self.ready or self.model is None:
+            return [""] * len(audios)
+        if len(audios) == 1 or not self._batch_ok or any(a.shape[0] > self.N_SAMPLES for a in audios):
+            return [self.transcribe(a, p) for a, p in zip(audios, prompts)]
         try:
-            segments, _ = self.model.transcribe(
-                audio_f32,
-                language="en",
-                vad_filter=False,
+            import ctranslate2
+            from faster_whisper.tokenizer import Tokenizer
+
+            if self._tokenizer is None:
+                self._tokenizer = Tokenizer(self.model.hf_tokenizer, self.model.model.is_multilingual,
+                                            task="transcribe", language="en")
+            tok = self._tokenizer
+
+            feats = None
+            padded = np.zeros(self.N_SAMPLES, dtype=np.float32)
+            for i, a in enumerate(audios):
+                # pad to a 30 s window like Whisper does, so every item shares one encoder shape
+                padded[:] = 0.0
+                padded[: a.shape[0]] = a
+                f = self.model.feature_extractor(padded)
+                if feats is None:
+                    feats = np.zeros((len(audios), f.shape[0], self.N_FRAMES), dtype=np.float32)
+                n = min(f.shape[-1], self.N_FRAMES)
+                feats[i, :, :n] = f[:, :n]
+
+            token_prompts = []
+            for p in prompts:
+                prev = tok.encode(" " + p.strip()) if p else []
+                token_prompts.append(self.model.get_prompt(tok, prev, without_timestamps=True))
+
+            results = self.model.model.generate(
+                ctranslate2.StorageView.from_array(feats),
+                token_prompts,
                 beam_size=1,
-                best_of=1,                      # Only use 1 candidate (faster)
-                temperature=0.0,                # Greedy sampling (fastest, deterministic)
-                condition_on_previous_text=False,  # No context dependency (faster)
-                without_timestamps=True,        # Skip timestamp generation (faster)
-                log_progress=False              # No progress logging (faster)
+                max_length=self.MAX_NEW_TOKENS,
+                suppress_blank=True,
+                suppress_tokens=[-1],
             )
-            text = " ".join(seg.text.strip() for seg in segments).strip()
-            return text
+            return [tok.decode(r.sequences_ids[0]).strip() for r in results]
+        except Exception as e:
+            print(f"⚠️ Batched ASR unavailable, falling back to sequential: {e}", file=sys.stderr)
+            self._batch_ok = False
+            return [self.transcribe(a, p) for a, p in zip(audios, prompts)]
+
+    def transcribe_words(self, audio_f32: np.ndarray, initial_prompt: Optional[str] = None,
+                         cancel: Optional[CancelToken] = None) -> List[Tuple[str, float, float]]:
+        """Word-level hypothesis as (word, start_s, end_s), used by StreamingTranscriber."""
+        if not self.ready or self.model is None:
+            return []
+        if cancel is not None and cancel.cancelled:
+            self._note_cancel(audio_f32.shape[0])
+            return []
+        try:
+            t0 = time.perf_counter()
+            words = []
+            for seg in self._decode(audio_f32, initial_prompt, word_timestamps=True):
+                if cancel is not None and cancel.cancelled:
+                    self._note_cancel_mid(audio_f32.shape[0], seg.end)
+                    return []
+                for w in (seg.words or []):
+                    text = w.word.strip()
+                    if text:
+                        words.append((text, float(w.start), float(w.end)))
+            self._note_rtf(audio_f32.shape[0], time.perf_counter() - t0)
+            return words
         except Exception:
-            return ""
+            return []
+
+def _norm_word(w: str) -> str:
+    return w.lower().strip(".,!?;:\"'()[]-")
+
+class _Stream:
+    __slots__ = ("committed", "offset", "hyp")
+
+    def __init__(self):
+        self.committed: List[str] = []
+        self.offset = 0    # samples already covered by committed words
+        self.hyp: List[Tuple[str, float, float]] = []  # last tail hypothesis, relative to offset
+
+class StreamingTranscriber:
+    """
+    Incremental transcription of growing segments, one stream per (source, utterance).
+
+    Partials only re-decode the audio after the committed point. A word is committed once
+    two consecutive hypotheses agree on it (local agreement) and the audio it covers is
+    trimmed from later decodes. The final decodes only the uncommitted tail and appends
+    it to the committed text instead of transcribing the segment from scratch.
+    """
+    def __init__(self, asr: ASREngine, sample_rate: int = 16000, min_tail_s: float = 0.5,
+                 prompt_chars: int = 200, max_streams: int = 8):
+        self.asr = asr
+        self.sr = sample_rate
+        self.min_tail = int(min_tail_s * sample_rate)
+        self.prompt_chars = prompt_chars
+        self.max_streams = max_streams
+        self._streams: Dict[Hashable, _Stream] = {}
+
+        self.decoded_samples = 0   # audio actually sent to the model
+        self.trimmed_samples = 0   # audio skipped because it was already committed
+        self.segment_samples = 0   # audio a full re-decode of every request would have sent
+
+    def _prompt(self, st: _Stream) -> Optional[str]:
+        if not st.committed:
+            return None
+        return " ".join(st.committed)[-self.prompt_chars:]
+
+    def partial(self, key: Hashable, audio_f32: np.ndarray, cancel: Optional[CancelToken] = None) -> str:
+        st = self._streams.get(key)
+        if st is None:
+            if len(self._streams) >= self.max_streams:
+                self._streams.pop(next(iter(self._streams)))
+            st = self._streams[key] = _Stream()
+
+        tail = audio_f32[st.offset:]
+        if tail.shape[0] >= self.min_tail:
+            words = self.asr.transcribe_words(tail, self._prompt(st), cancel=cancel)
+            if cancel is not None and cancel.cancelled:
+                # superseded mid-decode: keep the previous hypothesis
+                return ""
+            self.decoded_samples += tail.shape[0]
+            self.segment_samples += audio_f32.shape[0]
+
+            n = 0
+            while n < min(len(words), len(st.hyp)) and _norm_word(words[n][0]) == _norm_word(st.hyp[n][0]):
+                n += 1
+
+            if n:
+                cut = words[n - 1][2]
+                cut_samples = min(int(cut * self.sr), tail.shape[0])
+                st.committed.extend(w for w, _, _ in words[:n])
+                st.offset += cut_samples
+                self.trimmed_samples += cut_samples
+                st.hyp = [(w, s - cut, e - cut) for w, s, e in words[n:]]
+            else:
+                st.hyp = words
+
+        return " ".join(st.committed + [w for w, _, _ in st.hyp]).strip()
+
+    def prepare_final(self, key: Hashable, audio_f32: np.ndarray) -> Tuple[str, Optional[np.ndarray], Optional[str]]:
+        """Split a final into (committed text, tail audio still to decode or None, prompt)."""
+        st = self._streams.pop(key, None)
+        self.segment_samples += audio_f32.shape[0]
+        if st is None:
+            self.decoded_samples += audio_f32.shape[0]
+            return "", audio_f32, None
+
+        tail = audio_f32[st.offset:]
+        if tail.shape[0] >= self.min_tail // 2:
+            self.decoded_samples += tail.shape[0]
+            return " ".join(st.committed), tail, self._prompt(st)
+        return " ".join(st.committed + [w for w, _, _ in st.hyp]), None, None
+
+    def final(self, key: Hashable, audio_f32: np.ndarray) -> str:
+        prefix, tail, prompt = self.prepare_final(key, audio_f32)
+        rest = self.asr.transcribe(tail, prompt) if tail is not None else ""
+        return " ".join([prefix, rest]).strip()
+
+    def reset(self, key: Optional[Hashable] = None):
+        if key is None:
+            self._streams.clear()
+        else:
+            self._streams.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams": len(self._streams),
+            "decoded_s": self.decoded_samples / self.sr,
+            "trimmed_s": self.trimmed_samples / self.sr,
+            "full_redecode_s": self.segment_samples / self.sr,
+            "decoded_ratio": self.decoded_samples / self.segment_samples if self.segment_samples else 0.0,
+        }
@@ -6,11 +6,18 @@ from typing import Optional, Dict, Any
 import numpy as np
 import sounddevice as sd
 
+from app.audio.ring import BlockRing
 from app.audio.segmenter import Segmenter
 from app.utils.time import now_ms
 
 class AudioWorker(threading.Thread):
-    """Captures audio from a device. If loopback=True, uses WASAPI loopback."""
+    """
+    Captures audio from a device. If loopback=True, uses WASAPI loopback.
+
+    The PortAudio callback only copies raw float32 blocks into a lock-free BlockRing;
+    this thread drains the ring and runs clipping, VAD and segmentation, so a GIL stall
+    elsewhere delays segmentation instead of overflowing the input stream.
+    """
     def __init__(self, name: str, device: int, loopback: bool, sample_rate: int, out_q: queue.Queue):
         super().__init__(daemon=True)
         self.name = name
@@ -24,9 +31,58 @@ class AudioWorker(threading.Thread):
 
         self.segmenter = Segmenter(sample_rate=sample_rate, vad_mode=2)
 
+        self.blocksize = int(self.sample_rate * 0.1)  # 100ms
+        self.blocks = BlockRing(self.blocksize, slots=64)
+        self._f32 = np.zeros(self.blocksize, dtype=np.float32)
+
+        # callback status flags (written by the PortAudio thread only); read through stats()
+        self.xruns = 0
+        self.input_overflows = 0
+
     def stop(self):
         self.running.clear()
 
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "source": self.name,
+            "xruns": self.xruns,
+            "input_overflows": self.input_overflows,
+            "ring_dropped": self.blocks.dropped,
+            "ring_pending": len(self.blocks),
+            "segment_overflows": self.segmenter.ring.overflows,
+        }
+
+    def _callback(self, indata, frames, time_info, status):
+        if status:
+            self.xruns += 1
+            if status.input_overflow:
+                self.input_overflows += 1
+        if not self.running.is_set():
+            raise sd.CallbackStop()
+        self.blocks.push(indata[:, 0])
+
+    def _segment_block(self, block: np.ndarray):
+        n = block.shape[0]
+        x = self._f32[:n]
+        np.clip(block, -1.0, 1.0, out=x)
+
+        for ev in self.segmenter.feed(x):
+            self.out_q.put({
+                "source": self.name,
+                "kind": ev["type"],  # partial / final
+                "segment": ev["segment"],
+                "utt": ev["utt"],
+                "ms": ev["ms"],
+                "t": now_ms()
+            })
+
+    def _drain(self):
+        block = self.blocks.peek()
+        while block is not None:
+            self._segment_block(block)
+            self.blocks.advance()
+            block = self.blocks.peek()
+
     def run(self):
         extra = None
         if self.loopback:
@@ -35,37 +91,20 @@ class AudioWorker(threading.Thread):
             except Exception:
                 extra = None
 
-        blocksize = int(self.sample_rate * 0.1)  # 100ms
         ch = 1
 
-        def callback(indata, frames, time_info, status):
-            if not self.running.is_set():
-                raise sd.CallbackStop()
-
-            x = indata[:, 0].copy()
-            x = np.clip(x, -1.0, 1.0)
-            pcm16 = (x * 32767.0).astype(np.int16)
-
-            for ev in self.segmenter.feed(pcm16):
-                self.out_q.put({
-                    "source": self.name,
-                    "kind": ev["type"],  # partial / final
-                    "pcm16": ev["pcm16"],
-                    "ms": ev["ms"],
-                    "t": now_ms()
-                })
-
         try:
             with sd.InputStream(
                 device=self.device,
                 samplerate=self.sample_rate,
                 channels=ch,
                 dtype="float32",
-                blocksize=blocksize,
-                callback=callback,
+                blocksize=self.blocksize,
+                callback=self._callback,
                 extra_settings=extra
             ):
                 while self.running.is_set():
-                    time.sleep(0.2)
+                    self._drain()
+                    time.sleep(0.01)
         except Exception as e:
             self.out_q.put({"source": self.name, "kind": "error", "error": str(e), "t": now_ms()})
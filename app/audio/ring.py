@@ -0,0 +1,199 @@
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class Segment:
+    """Lease on a contiguous slice of a SegmentRing. Call release() when done with it."""
+    __slots__ = ("buf", "seg_id", "start", "length", "_ring", "_released")
+
+    def __init__(self, buf: np.ndarray, seg_id: int, start: int, length: int, ring: Optional["SegmentRing"]):
+        self.buf = buf
+        self.seg_id = seg_id
+        self.start = start
+        self.length = length
+        self._ring = ring
+        self._released = False
+
+    @property
+    def size(self) -> int:
+        return self.length
+
+    def audio(self) -> np.ndarray:
+        """Zero-copy float32 view; only valid until release()."""
+        return self.buf[self.start: self.start + self.length]
+
+    def pcm16(self) -> np.ndarray:
+        """int16 copy, for recording and export."""
+        return (np.clip(self.audio(), -1.0, 1.0) * 32767.0).astype(np.int16)
+
+    def tobytes(self) -> bytes:
+        return self.pcm16().tobytes()
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        if self._ring is not None:
+            self._ring._release(self.seg_id)
+
+
+class SegmentRing:
+    """
+    Preallocated per-source sample store for VAD segments.
+
+    Every open segment reserves `max_len` contiguous samples, so partial and final
+    events can hand out views instead of copying the utterance. A region is reused
+    only after its segment is closed and every lease on it has been released; if the
+    consumer holds on to all slots, the segment falls back to a private buffer.
+    """
+    def __init__(self, max_len: int, slots: int = 4, dtype=np.float32):
+        self.max_len = max_len
+        self.buf = np.zeros(max_len * max(2, slots), dtype=dtype)
+
+        self._lock = threading.Lock()
+        self._live: Dict[int, List[int]] = {}  # seg_id -> [start, length, refs, open]
+        self._head = 0
+        self._next_id = 0
+
+        self._cur_id = -1
+        self._cur_buf: Optional[np.ndarray] = None
+        self._cur_start = 0
+        self._cur_len = 0
+
+        self.overflows = 0
+
+    def _overlaps(self, start: int) -> bool:
+        end = start + self.max_len
+        for s, n, _refs, is_open in self._live.values():
+            used = self.max_len if is_open else n
+            if start < s + used and s < end:
+                return True
+        return False
+
+    def begin(self) -> int:
+        with self._lock:
+            if self._cur_buf is not None:
+                self._close_locked()
+
+            seg_id = self._next_id
+            self._next_id += 1
+
+            start = None
+            for cand in (self._head, 0):
+                if cand + self.max_len <= self.buf.size and not self._overlaps(cand):
+                    start = cand
+                    break
+
+            if start is None:
+                # consumer is still holding every slot: degrade to a private buffer
+                self.overflows += 1
+                self._cur_buf = np.zeros(self.max_len, dtype=self.buf.dtype)
+                self._cur_start = 0
+            else:
+                self._cur_buf = self.buf
+                self._cur_start = start
+                self._live[seg_id] = [start, 0, 0, 1]
+
+            self._cur_id = seg_id
+            self._cur_len = 0
+            return seg_id
+
+    def append(self, samples: np.ndarray) -> int:
+        if self._cur_buf is None:
+            return 0
+        n = min(int(samples.size), self.max_len - self._cur_len)
+        if n <= 0:
+            return 0
+        i = self._cur_start + self._cur_len
+        self._cur_buf[i: i + n] = samples[:n]
+        self._cur_len += n
+        return n
+
+    def lease(self) -> Optional[Segment]:
+        with self._lock:
+            if self._cur_buf is None:
+                return None
+            ring = None
+            entry = self._live.get(self._cur_id)
+            if entry is not None:
+                entry[2] += 1
+                ring = self
+            return Segment(self._cur_buf, self._cur_id, self._cur_start, self._cur_len, ring)
+
+    def close(self):
+        with self._lock:
+            self._close_locked()
+
+    def _close_locked(self):
+        if self._cur_buf is None:
+            return
+        entry = self._live.get(self._cur_id)
+        if entry is not None:
+            entry[1] = self._cur_len
+            entry[3] = 0
+            self._head = self._cur_start + self._cur_len
+            if entry[2] <= 0:
+                del self._live[self._cur_id]
+        self._cur_buf = None
+        self._cur_id = -1
+        self._cur_len = 0
+
+    def _release(self, seg_id: int):
+        with self._lock:
+            entry = self._live.get(seg_id)
+            if entry is None:
+                return
+            entry[2] -= 1
+            if entry[2] <= 0 and not entry[3]:
+                del self._live[seg_id]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"live_segments": len(self._live), "overflows": self.overflows}
+
+
+class BlockRing:
+    """
+    Lock-free single-producer/single-consumer ring of fixed-size float32 blocks.
+
+    The PortAudio callback is the only writer and the segmenter thread the only reader.
+    Each side advances just its own index, so nothing on the audio path takes a lock
+    or allocates. Blocks pushed while the ring is full are counted in `dropped`.
+    """
+    def __init__(self, block_len: int, slots: int = 64):
+        self.slots = slots
+        self.blocks = np.zeros((slots, block_len), dtype=np.float32)
+        self.lengths = [0] * slots
+
+        self._write = 0  # producer-owned
+        self._read = 0   # consumer-owned
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return self._write - self._read
+
+    def push(self, x: np.ndarray) -> bool:
+        w = self._write
+        if w - self._read >= self.slots:
+            self.dropped += 1
+            return False
+        i = w % self.slots
+        n = min(x.shape[0], self.blocks.shape[1])
+        self.blocks[i, :n] = x[:n]
+        self.lengths[i] = n
+        self._write = w + 1
+        return True
+
+    def peek(self) -> Optional[np.ndarray]:
+        """Oldest unread block as a view; valid until advance()."""
+        r = self._read
+        if r >= self._write:
+            return None
+        i = r % self.slots
+        return self.blocks[i, : self.lengths[i]]
+
+    def advance(self):
+        if self._read < self._write:
+            self._read += 1
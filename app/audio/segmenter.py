@@ -2,9 +2,17 @@ import numpy as np
 import webrtcvad
 from typing import List, Dict, Any
 
+from app.audio.ring import SegmentRing
+
 class Segmenter:
-    """VAD segmenter: emits partial and final speech segments."""
-    def __init__(self, sample_rate: int = 16000, vad_mode: int = 2):
+    """
+    VAD segmenter: emits partial and final speech segments.
+
+    Speech is written once, as float32, into a per-source SegmentRing; events carry a
+    Segment lease (a view into the ring) that the consumer must release() once it is
+    done with it. int16 is only produced per 20 ms frame for webrtcvad.
+    """
+    def __init__(self, sample_rate: int = 16000, vad_mode: int = 2, ring_slots: int = 4):
         self.sr = sample_rate
         self.vad = webrtcvad.Vad(vad_mode)
         self.frame_ms = 20
@@ -13,57 +21,72 @@ class Segmenter:
         self.partial_every_ms = 800
         self.max_segment_ms = 7000
 
-        self._buf = bytearray()
+        self.ring = SegmentRing(max_len=int(self.sr * self.max_segment_ms / 1000), slots=ring_slots, dtype=np.float32)
+
+        self._frame = np.zeros(self.frame_len, dtype=np.float32)
+        self._frame16 = np.zeros(self.frame_len, dtype=np.int16)
+        self._frame_bytes = memoryview(self._frame16).cast("B")
+        self._fill = 0
+
         self._active = False
-        self._segment = bytearray()
+        self._utt = -1
         self._silence_ms = 0
         self._last_partial_ms = 0
         self._segment_ms = 0
 
-    def feed(self, pcm16: np.ndarray) -> List[Dict[str, Any]]:
+    def feed(self, audio_f32: np.ndarray) -> List[Dict[str, Any]]:
+        """Feed clipped float32 samples in [-1, 1]."""
         events = []
-        self._buf.extend(pcm16.tobytes())
-
-        while len(self._buf) >= self.frame_len * 2:
-            frame = self._buf[: self.frame_len * 2]
-            del self._buf[: self.frame_len * 2]
-
-            try:
-                is_speech = self.vad.is_speech(frame, self.sr)
-            except Exception:
-                is_speech = False
+        i = 0
+        total = audio_f32.shape[0]
+        while i < total:
+            n = min(self.frame_len - self._fill, total - i)
+            self._frame[self._fill: self._fill + n] = audio_f32[i: i + n]
+            self._fill += n
+            i += n
+            if self._fill == self.frame_len:
+                self._fill = 0
+                self._process_frame(events)
+        return events
 
-            if is_speech:
-                if not self._active:
-                    self._active = True
-                    self._segment = bytearray()
-                    self._silence_ms = 0
-                    self._last_partial_ms = 0
-                    self._segment_ms = 0
+    def _process_frame(self, events: List[Dict[str, Any]]):
+        np.multiply(self._frame, 32767.0, out=self._frame16, casting="unsafe")
+        try:
+            is_speech = self.vad.is_speech(self._frame_bytes, self.sr)
+        except Exception:
+            is_speech = False
 
-                self._segment.extend(frame)
-                self._segment_ms += self.frame_ms
+        if is_speech:
+            if not self._active:
+                self._active = True
+                self._utt = self.ring.begin()
                 self._silence_ms = 0
+                self._last_partial_ms = 0
+                self._segment_ms = 0
 
-                self._last_partial_ms += self.frame_ms
-                if self._last_partial_ms >= self.partial_every_ms:
-                    self._last_partial_ms = 0
-                    events.append({"type": "partial", "pcm16": bytes(self._segment), "ms": self._segment_ms})
+            self.ring.append(self._frame)
+            self._segment_ms += self.frame_ms
+            self._silence_ms = 0
 
-                if self._segment_ms >= self.max_segment_ms:
-                    events.append({"type": "final", "pcm16": bytes(self._segment), "ms": self._segment_ms})
-                    self._active = False
-            else:
-                if self._active:
-                    self._silence_ms += self.frame_ms
-                    if self._silence_ms >= self.silence_end_ms:
-                        events.append({"type": "final", "pcm16": bytes(self._segment), "ms": self._segment_ms})
-                        self._active = False
+            self._last_partial_ms += self.frame_ms
+            if self._last_partial_ms >= self.partial_every_ms:
+                self._last_partial_ms = 0
+                events.append({"type": "partial", "segment": self.ring.lease(), "ms": self._segment_ms, "utt": self._utt})
 
-        return events
+            if self._segment_ms >= self.max_segment_ms:
+                events.append({"type": "final", "segment": self.ring.lease(), "ms": self._segment_ms, "utt": self._utt})
+                self.ring.close()
+                self._active = False
+        else:
+            if self._active:
+                self._silence_ms += self.frame_ms
+                if self._silence_ms >= self.silence_end_ms:
+                    events.append({"type": "final", "segment": self.ring.lease(), "ms": self._segment_ms, "utt": self._utt})
+                    self.ring.close()
+                    self._active = False
 
-def pcm_bytes_to_float32(pcm_bytes: bytes) -> np.ndarray:
+def pcm_bytes_to_float32(pcm_bytes) -> np.ndarray:
+    """PCM16 (recordings/exports) to float32; the live path already carries float32."""
     a = np.frombuffer(pcm_bytes, dtype=np.int16).astype(np.float32)
-    if a.size == 0:
-        return np.zeros((0,), dtype=np.float32)
-    return (a / 32768.0).astype(np.float32)
+    a *= 1.0 / 32768.0
+    return a
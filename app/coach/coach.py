@@ -1,11 +1,38 @@
-from typing import Dict, Any, List, Tuple, Optional
+from collections import deque
+from typing import Callable, Deque, Dict, Any, List, Tuple, Optional
 
 from app.coach.embedder import Embedder
+from app.coach.summarizer import HistorySummarizer
 from app.coach.translator import TranslatorENES
 from app.rag.pdf_store import DocumentStore
 from app.llm.llm_engine import LLMEngine
+from app.llm.prompt_budget import PromptBudget
+from app.pipeline.transcript_delta import edit_distance_at_least, normalize_transcript
+from app.utils.cache import LRUCache
+from app.utils.cancel import CancelToken
+
+# GBNF for the reply shape requested in _system_prompt; say_now comes first so it
+# can be streamed to the overlay.
+_STRING_GBNF = r'''
+string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" ( ["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] ) )* "\""
+ws ::= [ \t\n]?
+'''
+
+SUGGESTION_GRAMMAR = r'''
+root ::= "{" ws "\"say_now\":" ws string "," ws "\"intent\":" ws string "," ws "\"must_include\":" ws array ( "," ws "\"bridge_now\":" ws string )? ws "}"
+array ::= "[" ws ( string ( "," ws string )* )? ws "]"
+''' + _STRING_GBNF
+
+BRIDGE_GRAMMAR = r'''
+root ::= "{" ws "\"bridge_now\":" ws string "," ws "\"say_now\":" ws string ws "}"
+''' + _STRING_GBNF
 
 class Coach:
+    MAX_REPLY_TOKENS = 90
+    HISTORY_MAX = 20  # raw turns kept here; older ones live on in the summary
+    # share of the context window left after the static head and the reply
+    PROMPT_SHARES = {"latest": 0.2, "doc": 0.35, "history": 0.45}
+
     def __init__(self,
                  profile_context: str,
                  goal_context: str,
@@ -15,7 +42,12 @@ class Coach:
                  llm: LLMEngine,
                  embedder: Embedder,
                  docstore: DocumentStore,
-                 translator: TranslatorENES):
+                 translator: TranslatorENES,
+                 cache_size: int = 64,
+                 cache_ttl_s: float = 30.0,
+                 promote_max_edit: int = 6,
+                 summarize: bool = True,
+                 summary_idle_s: float = 1.5):
         self.profile_context = profile_context
         self.goal_context = goal_context
 
@@ -28,12 +60,42 @@ class Coach:
         self.docstore = docstore
         self.translator = translator
 
-        self.history: List[Tuple[str, str]] = []  # (speaker, text)
+        self.history: Deque[Tuple[str, str]] = deque(maxlen=self.HISTORY_MAX)  # (speaker, text)
         self.topic_vec: Optional[object] = None
 
         self.last_suggest: Dict[str, Any] = {}
         self.last_her_text = ""
 
+        # the conversation lives in the LLM session as appended turns; turns evicted
+        # from it are folded into a running summary that follows the static prompt
+        self.llm.clear_turns()
+        self.summarizer: Optional[HistorySummarizer] = None
+        if summarize:
+            self.summarizer = HistorySummarizer(self.llm, self._system_prompt, self._static_prompt,
+                                                idle_s=summary_idle_s)
+            self.llm.on_evict = self.summarizer.add
+            self.summarizer.start()
+
+        # suggestions keyed on (kind, normalized HER text, history, document context)
+        self.cache = LRUCache(cache_size, cache_ttl_s) if cache_size > 0 else None
+
+        # latest completed draft (utterance, normalized HER text, suggestion); a final
+        # within `promote_max_edit` characters of it reuses the suggestion
+        self.promote_max_edit = promote_max_edit
+        self._draft: Optional[Tuple[Any, str, Dict[str, Any]]] = None
+        self.promotions = 0
+
+        # token budget per prompt section; session turns beyond theirs are evicted
+        self.budget = PromptBudget(self.llm.count_tokens, self.llm.n_ctx, self.PROMPT_SHARES)
+        self._head_tokens = self.llm.count_tokens(
+            f"<|system|>\n{self._system_prompt()}\n<|user|>\n{self._static_prompt()}")
+        if self.summarizer is not None:
+            self._head_tokens += self.summarizer.max_tokens + 4
+        self._frame_tokens = self.llm.count_tokens(self._build_user_prompt("x", "", "x"))
+        avail = self.budget.available(self._head_tokens + self._frame_tokens, self.MAX_REPLY_TOKENS)
+        self.llm.turn_budget = self.budget.split(avail, {})["history"]
+        self.last_prompt_tokens: Dict[str, int] = {}
+
     def _update_topic(self, text: str):
         v = self.embedder.encode(text)
         if v is not None:
@@ -56,25 +118,65 @@ class Coach:
             "Return JSON keys: say_now, intent, must_include (array), bridge_now (optional).\n"
         )
 
-    def _build_user_prompt(self, her_text: str, me_partial: str = "", doc_ctx: str = "") -> str:
-        hist = "\n".join([f"{spk.upper()}: {txt}" for spk, txt in self.history[-6:]])
-        doc_part = f"\nDOCUMENT_CONTEXT:\n{doc_ctx}\n" if doc_ctx else ""
+    def _static_prompt(self) -> str:
+        # identical for every call until the summary changes: LLMEngine keeps its KV
+        # state cached. The RECENT turns follow it from the LLM session (see _add_turn).
+        summary = self.summarizer.summary if self.summarizer is not None else ""
+        summary_part = f"SUMMARY:\n{summary}\n\n" if summary else ""
         return (
             f"PROFILE:\n{self.profile_context}\n\n"
             f"GOAL:\n{self.goal_context}\n\n"
-            f"RECENT:\n{hist}\n\n"
-            f"HER_LATEST:\n{her_text}\n\n"
+            f"{summary_part}"
+            f"RECENT:\n"
+        )
+
+    def _preempt_background(self):
+        if self.summarizer is not None:
+            self.summarizer.preempt()
+
+    def close(self):
+        if self.summarizer is not None:
+            self.summarizer.stop()
+            self.llm.on_evict = None
+
+    def _add_turn(self, speaker: str, text: str):
+        self.history.append((speaker, text))
+        self.llm.append_turn(f"{speaker.upper()}: {text}\n")
+
+    def _build_user_prompt(self, her_text: str, me_partial: str = "", doc_ctx: str = "") -> str:
+        """Changing part of the user message; goes after _static_prompt() and the session turns."""
+        doc_part = f"\nDOCUMENT_CONTEXT:\n{doc_ctx}\n" if doc_ctx else ""
+        return (
+            f"\nHER_LATEST:\n{her_text}\n\n"
             f"MY_PARTIAL:\n{me_partial}\n"
             f"{doc_part}\n"
             f"Write only JSON."
         )
 
+    def _budgeted_user_prompt(self, her_text: str, doc_ctx: str, max_tokens: int) -> str:
+        """_build_user_prompt() with HER text and document snippets trimmed to their budgets."""
+        count = self.llm.count_tokens
+        snippets = doc_ctx.split("\n") if doc_ctx else []  # best match first
+        avail = self.budget.available(self._head_tokens + self._frame_tokens, max_tokens)
+        budgets = self.budget.split(avail, {
+            "latest": count(her_text),
+            "doc": sum(count(s + "\n") for s in snippets),
+        })
+        her = self.budget.fit_text(her_text, budgets["latest"], keep_end=True)
+        doc = "\n".join(self.budget.fit_items(snippets, budgets["doc"]))
+        self.last_prompt_tokens = {
+            "head": self._head_tokens,
+            "latest": count(her),
+            "doc": count(doc) if doc else 0,
+        }
+        return self._build_user_prompt(her, "", doc)
+
     def maybe_translate_her(self, text: str) -> str:
         if not self.enable_translation:
             return ""
         return self.translator.translate(text)
 
-    def _maybe_retrieve_doc(self, query: str) -> str:
+    def retrieve_doc(self, query: str) -> str:
         if not self.enable_document or not self.docstore.chunks:
             return ""
         hits = self.docstore.retrieve(query, k=3)
@@ -90,34 +192,90 @@ class Coach:
                 parts.append(snippet)
         return "\n".join(parts)
 
-    def suggest_draft(self, her_partial: str) -> Dict[str, Any]:
+    def _suggest(self, kind: str, her_text: str, doc_ctx: str, max_tokens: int,
+                 cancel: Optional[CancelToken] = None,
+                 on_say_now: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        history = tuple(self.history)
+        if history and history[-1] == ("her", her_text):
+            history = history[:-1]  # the turn being answered: a retried final keys like the first try
+        key = (kind, normalize_transcript(her_text), hash((history, self._static_prompt())), hash(doc_ctx))
+        if self.cache is not None:
+            hit = self.cache.get(key)
+            if hit is not None:
+                if on_say_now is not None and hit.get("say_now"):
+                    on_say_now(hit["say_now"])
+                return dict(hit)
+
+        # Always use LLM, no fallback templates
+        user = self._budgeted_user_prompt(her_text, doc_ctx, max_tokens)
+        out = self.llm.generate_json(self._system_prompt(), user,
+                                     max_tokens=max_tokens, cancel=cancel, prefix=self._static_prompt(),
+                                     with_turns=True, on_say_now=on_say_now, grammar=SUGGESTION_GRAMMAR)
+        self.last_prompt_tokens["history"] = self.llm.turn_tokens()
+        self.last_prompt_tokens["total"] = self.llm.last_prompt_tokens
+        if out and self.cache is not None and not (cancel is not None and cancel.cancelled):
+            self.cache.put(key, dict(out))
+        return out
+
+    def draft_matches(self, draft_text: str, text: str) -> bool:
+        """True if a suggestion drafted for `draft_text` still fits `text`."""
+        if self.promote_max_edit <= 0:
+            return False
+        return not edit_distance_at_least(normalize_transcript(draft_text), normalize_transcript(text),
+                                          self.promote_max_edit)
+
+    def promotable(self, her_final: str, utt: Any = None) -> bool:
+        """True if suggest_final(her_final, utt=utt) will reuse the current draft."""
+        draft = self._draft
+        return draft is not None and draft[0] == utt and self.draft_matches(draft[1], her_final)
+
+    def suggest_draft(self, her_partial: str, cancel: Optional[CancelToken] = None,
+                      on_say_now: Optional[Callable[[str], None]] = None, utt: Any = None,
+                      doc_ctx: Optional[str] = None) -> Dict[str, Any]:
+        """`doc_ctx` is retrieved here unless the caller already has it."""
         if not her_partial.strip():
             return {}
+        if cancel is not None and cancel.cancelled:
+            return {}
+        self._preempt_background()
         
-        doc_ctx = self._maybe_retrieve_doc(her_partial)
-        
-        # Always use LLM, no fallback templates
-        out = self.llm.generate_json(self._system_prompt(), self._build_user_prompt(her_partial, "", doc_ctx), max_tokens=70)
+        if doc_ctx is None:
+            doc_ctx = self.retrieve_doc(her_partial)
+        out = self._suggest("draft", her_partial, doc_ctx, 70, cancel, on_say_now)
+        if out and not (cancel is not None and cancel.cancelled):
+            self._draft = (utt, her_partial, out)
         return out
 
-    def suggest_final(self, her_final: str) -> Dict[str, Any]:
+    def suggest_final(self, her_final: str, on_say_now: Optional[Callable[[str], None]] = None,
+                      utt: Any = None, doc_ctx: Optional[str] = None) -> Dict[str, Any]:
         if not her_final.strip():
             return {}
+        self._preempt_background()
         self.last_her_text = her_final
-        self.history.append(("her", her_final))
+        if not self.history or self.history[-1] != ("her", her_final):
+            self._add_turn("her", her_final)  # a retried final is not a new turn
         self._update_topic(her_final)
 
-        doc_ctx = self._maybe_retrieve_doc(her_final)
-
-        # Always use LLM, no fallback templates
-        out = self.llm.generate_json(self._system_prompt(), self._build_user_prompt(her_final, "", doc_ctx), max_tokens=90)
+        promote = self.promotable(her_final, utt)
+        draft, self._draft = self._draft, None
+        if promote:
+            # the final only confirms the partial we already answered: promote the draft
+            self.promotions += 1
+            out = dict(draft[2])
+            if on_say_now is not None and out.get("say_now"):
+                on_say_now(out["say_now"])
+        else:
+            if doc_ctx is None:
+                doc_ctx = self.retrieve_doc(her_final)
+            out = self._suggest("final", her_final, doc_ctx, self.MAX_REPLY_TOKENS, on_say_now=on_say_now)
         self.last_suggest = out
         return out
 
     def evaluate_me(self, me_final: str) -> Dict[str, Any]:
         if not me_final.strip():
             return {}
-        self.history.append(("me", me_final))
+        self._preempt_background()
+        self._add_turn("me", me_final)
 
         status = "ok"
         notes = []
@@ -139,9 +297,19 @@ class Coach:
         suggest = {}
         if status == "topic_shift":
             # Use LLM to generate bridge suggestion
-            bridge_prompt = f"Generate a brief bridge phrase to transition from '{self.last_her_text}' to a new topic. Return JSON with bridge_now and say_now keys."
-            bridge_response = self.llm.generate_json(self._system_prompt(), bridge_prompt, max_tokens=60)
+            bridge_prompt = f"\nGenerate a brief bridge phrase to transition from '{self.last_her_text}' to a new topic. Return JSON with bridge_now and say_now keys."
+            bridge_response = self.llm.generate_json(self._system_prompt(), bridge_prompt, max_tokens=60,
+                                                     prefix=self._static_prompt(), with_turns=True,
+                                                     grammar=BRIDGE_GRAMMAR)
             if bridge_response:
                 suggest = bridge_response
 
         return {"status": status, "notes": notes, "suggest": suggest}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cache": self.cache.stats() if self.cache is not None else {},
+            "promotions": self.promotions,
+            "last_prompt_tokens": dict(self.last_prompt_tokens),
+            "summary": self.summarizer.stats() if self.summarizer is not None else {},
+        }
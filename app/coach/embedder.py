@@ -1,25 +1,108 @@
-from typing import Optional
+import hashlib
+from typing import List, Optional
 import numpy as np
 
+from app.utils.cache import LRUCache
+
 try:
     from sentence_transformers import SentenceTransformer
 except Exception:
     SentenceTransformer = None
 
+MODEL_NAME = "all-MiniLM-L6-v2"
+
 class Embedder:
-    def __init__(self):
+    """
+    MiniLM sentence embeddings (normalized float32).
+
+    Results are kept in a bounded LRU keyed by a hash of the text, shared by every
+    consumer (topic tracking, topic-shift checks, document retrieval). Cached vectors
+    are read-only.
+    """
+    def __init__(self, cache_size: int = 512):
         self.model = None
+        self.model_name = MODEL_NAME
+        self.cache = LRUCache(cache_size)
         if SentenceTransformer is not None:
             try:
-                self.model = SentenceTransformer("all-MiniLM-L6-v2")
+                self.model = SentenceTransformer(self.model_name)
             except Exception:
                 self.model = None
 
+    @property
+    def dim(self) -> int:
+        if self.model is None:
+            return 0
+        return int(self.model.get_sentence_embedding_dimension())
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
     def encode(self, text: str) -> Optional[np.ndarray]:
         if self.model is None:
             return None
-        v = self.model.encode([text], normalize_embeddings=True)[0]
-        return np.asarray(v, dtype=np.float32)
+        key = self._key(text)
+        v = self.cache.get(key)
+        if v is None:
+            v = np.asarray(self.model.encode([text], normalize_embeddings=True)[0], dtype=np.float32)
+            v.setflags(write=False)
+            self.cache.put(key, v)
+        return v
+
+    def encode_many(self, texts: List[str], batch_size: int = 32, cache: bool = True) -> Optional[np.ndarray]:
+        """
+        (len(texts), dim) matrix; texts not cached yet are embedded together.
+        With cache=False (bulk document chunks) the LRU is neither read nor filled.
+        """
+        if self.model is None:
+            return None
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if not cache:
+            return self.encode_into(texts, batch_size=batch_size)
+
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        keys = [self._key(t) for t in texts]
+        missing = []
+        for i in range(len(texts)):
+            v = self.cache.get(keys[i])
+            if v is None:
+                missing.append(i)
+            else:
+                out[i] = v
+
+        if missing:
+            vecs = self.encode_into([texts[i] for i in missing], batch_size=batch_size)
+            out[missing] = vecs
+            for i, v in zip(missing, vecs):
+                v.setflags(write=False)
+                self.cache.put(keys[i], v)
+        return out
+
+    def encode_into(self, texts: List[str], out: Optional[np.ndarray] = None,
+                    batch_size: int = 32) -> Optional[np.ndarray]:
+        """
+        Embed `texts` into the rows of `out` (a preallocated (len(texts), dim) float32
+        matrix; allocated if None). Texts are sorted by length and batched in that order,
+        so each forward pass pads to similar lengths. Bypasses the cache.
+        """
+        if self.model is None:
+            return None
+        n = len(texts)
+        if out is None:
+            out = np.empty((n, self.dim), dtype=np.float32)
+        order = sorted(range(n), key=lambda i: len(texts[i]))
+        batch_size = max(1, batch_size)
+        for s in range(0, n, batch_size):
+            idx = order[s: s + batch_size]
+            vecs = self.model.encode([texts[i] for i in idx], batch_size=len(idx),
+                                     normalize_embeddings=True, convert_to_numpy=True)
+            out[idx] = vecs
+        return out
+
+    def stats(self):
+        return self.cache.stats()
 
     @staticmethod
     def cosine(a: np.ndarray, b: np.ndarray) -> float:
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, List, Optional
+
+from app.llm.llm_engine import LLMEngine
+from app.utils.cancel import CancelToken
+
+SUMMARY_GRAMMAR = r'''
+root ::= "{" ws "\"summary\":" ws string ws "}"
+string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" ( ["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] ) )* "\""
+ws ::= [ \t\n]?
+'''
+
+class HistorySummarizer(threading.Thread):
+    """
+    Folds conversation turns evicted from the LLM session into a short running summary.
+
+    Set `add` as LLMEngine.on_evict. The work only starts once the LLM has been idle
+    for `idle_s` and is abandoned as soon as preempt() is called (at the start of every
+    coaching request), so it never sits on the critical path. The request reuses the
+    coach's system prompt, prefix and session turns, which keeps them in the KV cache;
+    after a new summary is published, the new prefix is pre-evaluated while still idle.
+    """
+    MAX_BATCH_CHARS = 1200
+
+    def __init__(self, llm: LLMEngine, system: Callable[[], str], prefix: Callable[[], str],
+                 idle_s: float = 1.5, max_tokens: int = 80):
+        super().__init__(name="history-summarizer", daemon=True)
+        self.llm = llm
+        self.system = system
+        self.prefix = prefix
+        self.idle_s = idle_s
+        self.max_tokens = max_tokens
+
+        self.summary = ""
+        self._pending: Deque[str] = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._busy_t = time.monotonic()
+        self._cancel: Optional[CancelToken] = None
+        self.running = threading.Event()
+        self.running.set()
+
+        self.updates = 0
+        self.preempted = 0
+
+    def add(self, texts: List[str]):
+        with self._lock:
+            self._pending.extend(t for t in texts if t.strip())
+        self._wake.set()
+
+    def preempt(self):
+        self._busy_t = time.monotonic()
+        tok = self._cancel
+        if tok is not None and not tok.cancelled:
+            tok.cancel()
+            self.preempted += 1
+
+    def stop(self):
+        self.running.clear()
+        self.preempt()
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {"chars": len(self.summary), "updates": self.updates, "preempted": self.preempted,
+                "pending": pending}
+
+    def _idle(self) -> bool:
+        last = max(self._busy_t, self.llm.last_used)
+        return time.monotonic() - last >= self.idle_s and not self.llm.busy
+
+    def _take_batch(self) -> List[str]:
+        with self._lock:
+            batch, size = [], 0
+            while self._pending and (not batch or size + len(self._pending[0]) <= self.MAX_BATCH_CHARS):
+                batch.append(self._pending.popleft())
+                size += len(batch[-1])
+            return batch
+
+    def _put_back(self, batch: List[str]):
+        with self._lock:
+            self._pending.extendleft(reversed(batch))
+
+    def run(self):
+        while self.running.is_set():
+            self._wake.wait(timeout=1.0)
+            if not self.running.is_set():
+                break
+            if not self._pending:
+                self._wake.clear()
+                continue
+            if not self._idle():
+                time.sleep(0.2)
+                continue
+
+            batch = self._take_batch()
+            tok = self._cancel = CancelToken()
+            try:
+                out = self.llm.generate_json(
+                    self.system(),
+                    "\nOLDER_TURNS:\n" + "".join(batch) +
+                    "\nRewrite SUMMARY so it also covers OLDER_TURNS, in at most 3 short sentences "
+                    "(names, topics, facts, commitments). Return JSON with a summary key.",
+                    max_tokens=self.max_tokens, cancel=tok, prefix=self.prefix(),
+                    with_turns=True, grammar=SUMMARY_GRAMMAR)
+            except Exception:
+                out = {}
+            summary = (out.get("summary") or "").strip() if isinstance(out, dict) else ""
+            if tok.cancelled:
+                self._put_back(batch)
+                continue
+            if not summary:
+                # the model failed to summarize: keep the tail of the raw text instead of retrying forever
+                summary = (self.summary + " " + " ".join(b.strip() for b in batch))[-3 * self.max_tokens:].strip()
+
+            self.summary = summary
+            self.updates += 1
+            # evaluate the new prefix + turns now rather than on the next request
+            self.llm.prewarm(self.system(), self.prefix(), cancel=tok)
+            self._cancel = None
@@ -1,6 +1,12 @@
 import json
 import os
-from typing import Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from app.utils.cache import LRUCache
+from app.utils.cancel import CancelStats, CancelToken
 
 try:
     from llama_cpp import Llama
@@ -9,6 +15,11 @@ except (ImportError, ModuleNotFoundError) as e:
     Llama = None
     LLAMA_CPP_AVAILABLE = False
 
+try:
+    from llama_cpp import LlamaGrammar
+except (ImportError, ModuleNotFoundError):
+    LlamaGrammar = None
+
 def safe_json_extract(text: str) -> Dict[str, Any]:
     text = text.strip()
     i = text.find("{")
@@ -20,13 +31,135 @@ def safe_json_extract(text: str) -> Dict[str, Any]:
             return {}
     return {}
 
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+def partial_json_string(text: str, key: str) -> Optional[str]:
+    """
+    Value of the string field `key` in possibly unfinished JSON `text`, as far as it
+    has been generated (None until the opening quote of the value is seen).
+    """
+    i = text.find(f'"{key}"')
+    if i < 0:
+        return None
+    i = text.find(":", i + len(key) + 2)
+    if i < 0:
+        return None
+    i += 1
+    while i < len(text) and text[i] in " \t\r\n":
+        i += 1
+    if i >= len(text) or text[i] != '"':
+        return None
+
+    out = []
+    i += 1
+    while i < len(text):
+        c = text[i]
+        if c == '"':
+            break
+        if c == "\\":
+            if i + 1 >= len(text):
+                break  # escape not complete yet
+            e = text[i + 1]
+            if e == "u":
+                if i + 6 > len(text):
+                    break
+                try:
+                    out.append(chr(int(text[i + 2: i + 6], 16)))
+                except ValueError:
+                    pass
+                i += 6
+                continue
+            out.append(_ESCAPES.get(e, e))
+            i += 2
+            continue
+        out.append(c)
+        i += 1
+    return "".join(out)
+
+class _ObjectEnd:
+    """Tracks brace depth over streamed JSON text; done once the top-level object closes."""
+    __slots__ = ("depth", "in_str", "esc", "started", "done")
+
+    def __init__(self):
+        self.depth = 0
+        self.in_str = False
+        self.esc = False
+        self.started = False
+        self.done = False
+
+    def feed(self, text: str) -> bool:
+        for c in text:
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif c == "\\":
+                    self.esc = True
+                elif c == '"':
+                    self.in_str = False
+            elif c == '"':
+                if self.started:
+                    self.in_str = True
+            elif c == "{":
+                self.depth += 1
+                self.started = True
+            elif c == "}" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.done = True
+                    break
+        return self.done
+
 class LLMEngine:
+    """
+    llama.cpp wrapper that returns JSON suggestions.
+
+    Prompts are `<|system|> system <|user|> prefix + user <|assistant|>`. The static
+    `prefix` (profile/goal) is evaluated once together with the system prompt and its
+    KV state is snapshotted; later requests restore that snapshot when needed and only
+    evaluate the tokens after it. A changed system or prefix text gets a new snapshot
+    (the few most recent ones are kept).
+
+    Conversation turns (append_turn) form a rolling session that sits right after the
+    prefix. Turns are only ever appended, so consecutive requests share
+    prefix + turns in the KV cache and evaluate just the new turn and the request tail.
+    When the context would overflow, the oldest turns are evicted in one block and the
+    KV cache is shifted down instead of re-evaluated; `on_evict` receives their text.
+
+    Replies are streamed: with `on_say_now`, the partial `say_now` value is parsed out
+    of the JSON as tokens arrive and reported every time it grows. A GBNF `grammar`
+    constrains the reply to the expected object, and generation stops as soon as the
+    top-level object closes.
+    """
+    MAX_PREFIXES = 4
+
     def __init__(self, model_path: str, n_ctx: int, n_threads: int):
         self.model_path = model_path
         self.n_ctx = n_ctx
         self.n_threads = n_threads
         self.llm = None
         self.ready = False
+        self.ms_per_token = 15.0  # running estimate, used to price cancelled work
+        self.cancel_stats = CancelStats()
+
+        self._lock = threading.Lock()
+        self._prefix_ok = True
+        self._prefixes: "OrderedDict[Tuple[str, str], Tuple[List[int], Any]]" = OrderedDict()
+        self.prefix_builds = 0
+        self.prefix_restores = 0
+        self.last_prompt_tokens = 0
+        self.last_eval_tokens = 0
+        self.first_say_ms = 0.0  # request start -> first visible say_now text
+        self.last_used = time.monotonic()  # end of the last request
+        self._grammars: Dict[str, Any] = {}  # GBNF text -> compiled grammar (None if unsupported)
+        self.early_stops = 0
+        self.json_failures = 0
+
+        self._token_counts = LRUCache(2048)  # text -> token count
+        self.turn_budget: Optional[int] = None  # max tokens of session turns (None = up to n_ctx)
+        self.turns: List[Tuple[str, List[int]]] = []
+        self.on_evict: Optional[Callable[[List[str]], None]] = None
+        self.turns_evicted = 0
+        self.kv_shifts = 0
         self._init()
 
     def _init(self):
@@ -50,20 +183,290 @@ class LLMEngine:
         except Exception as e:
             raise RuntimeError(f"Failed to initialize LLM: {e}")
 
-    def generate_json(self, system: str, user: str, max_tokens: int = 90) -> Dict[str, Any]:
+    def _tokenize(self, text: str, add_bos: bool) -> List[int]:
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=add_bos, special=True)
+
+    def _cached_prefix(self, system: str, prefix: str) -> Tuple[List[int], Any]:
+        """Tokens and KV snapshot of the static head, built on first use."""
+        key = (system, prefix)
+        hit = self._prefixes.get(key)
+        if hit is not None:
+            self._prefixes.move_to_end(key)
+            return hit
+        tokens = self._tokenize(f"<|system|>\n{system}\n<|user|>\n{prefix}", add_bos=True)
+        self.llm.reset()
+        self.llm.eval(tokens)
+        hit = self._prefixes[key] = (tokens, self.llm.save_state())
+        if len(self._prefixes) > self.MAX_PREFIXES:
+            self._prefixes.popitem(last=False)
+        self.prefix_builds += 1
+        return hit
+
+    def _reused_tokens(self, tokens: List[int]) -> int:
+        n = 0
+        for a, b in zip(self.llm.input_ids[: self.llm.n_tokens], tokens):
+            if a != b:
+                break
+            n += 1
+        return n
+
+    def count_tokens(self, text: str) -> int:
+        """Token count of `text` with the model tokenizer, cached per string."""
+        n = self._token_counts.get(text)
+        if n is None:
+            try:
+                n = len(self._tokenize(text, add_bos=False))
+            except Exception:
+                n = len(text) // 4 + 1
+            self._token_counts.put(text, n)
+        return n
+
+    def turn_tokens(self) -> int:
+        if not self._prefix_ok:
+            return sum(self.count_tokens(text) for text, _ in self.turns)
+        return sum(len(t) for _, t in self.turns)
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def prewarm(self, system: str, prefix: str = "", with_turns: bool = True,
+                cancel: Optional[CancelToken] = None, chunk: int = 64):
+        """
+        Evaluate the head (and session turns) into the KV cache ahead of the next
+        request, in chunks so `cancel` can cut it short.
+        """
+        with self._lock:
+            if not self.ready or not self._prefix_ok:
+                return
+            try:
+                head, state = self._cached_prefix(system, prefix)
+                if self._reused_tokens(head) < len(head):
+                    self.llm.load_state(state)
+                    self.prefix_restores += 1
+                tokens = head + ([tok for _, t in self.turns for tok in t] if with_turns else [])
+                self._eval_chunked(tokens, cancel, chunk)
+            except Exception:
+                pass
+
+    def _eval_chunked(self, tokens: List[int], cancel: Optional[CancelToken], chunk: int = 64) -> bool:
+        """Evaluate `tokens` past the cached prefix, `chunk` at a time. False if cancelled."""
+        n = self._reused_tokens(tokens)
+        self.llm.n_tokens = n
+        while n < len(tokens):
+            if cancel is not None and cancel.cancelled:
+                return False
+            self.llm.eval(tokens[n: n + chunk])
+            n = self.llm.n_tokens
+        return True
+
+    def append_turn(self, text: str):
+        with self._lock:
+            tokens = self._tokenize(text, add_bos=False) if self.ready and self._prefix_ok else []
+            self.turns.append((text, tokens))
+
+    def clear_turns(self):
+        with self._lock:
+            self.turns = []
+
+    def _grammar(self, gbnf: Optional[str]):
+        if not gbnf or LlamaGrammar is None:
+            return None
+        if gbnf not in self._grammars:
+            try:
+                self._grammars[gbnf] = LlamaGrammar.from_string(gbnf, verbose=False)
+            except Exception:
+                self._grammars[gbnf] = None
+        return self._grammars[gbnf]
+
+    def _shift_kv(self, n_keep: int, n_discard: int):
+        """Drop KV cells [n_keep, n_keep + n_discard) and move the rest down."""
+        import llama_cpp
+        n_past = self.llm.n_tokens
+        try:
+            ctx = self.llm._ctx.ctx
+            seq_rm = getattr(llama_cpp, "llama_kv_self_seq_rm", None) or llama_cpp.llama_kv_cache_seq_rm
+            seq_add = (getattr(llama_cpp, "llama_kv_self_seq_add", None)
+                       or getattr(llama_cpp, "llama_kv_cache_seq_add", None)
+                       or llama_cpp.llama_kv_cache_seq_shift)
+            seq_rm(ctx, 0, n_keep, n_keep + n_discard)
+            seq_add(ctx, 0, n_keep + n_discard, n_past, -n_discard)
+            ids = self.llm.input_ids
+            ids[n_keep: n_past - n_discard] = ids[n_keep + n_discard: n_past].copy()
+            self.llm.n_tokens = n_past - n_discard
+            self.kv_shifts += 1
+        except Exception:
+            # no shift support: keep the prefix and let the turns be re-evaluated once
+            self.llm.n_tokens = min(n_past, n_keep)
+
+    def _fit_turns(self, head: List[int], tail_len: int, max_tokens: int):
+        budget = self.n_ctx - len(head) - tail_len - max_tokens - 8
+        if self.turn_budget is not None:
+            budget = min(budget, self.turn_budget)
+        total = sum(len(t) for _, t in self.turns)
+        if total <= budget:
+            return
+
+        # evict down to 3/4 of the budget so shifts stay rare
+        target = int(max(0, budget) * 0.75)
+        drop, dropped = 0, 0
+        while drop < len(self.turns) and total - dropped > target:
+            dropped += len(self.turns[drop][1])
+            drop += 1
+
+        # the KV cache holds head + turns up to the newest evaluated one
+        cached = self._reused_tokens(head + [tok for _, t in self.turns for tok in t])
+
+        evicted = self.turns[:drop]
+        self.turns = self.turns[drop:]
+        self.turns_evicted += drop
+        if dropped and cached >= len(head) + dropped:
+            self.llm.n_tokens = cached
+            self._shift_kv(len(head), dropped)
+        if self.on_evict is not None:
+            self.on_evict([text for text, _ in evicted])
+
+    def _fit_text_turns(self, system: str, user: str, prefix: str, max_tokens: int):
+        """_fit_turns() for the string-prompt fallback: turns are measured with count_tokens."""
+        fixed = self.count_tokens(f"<|system|>\n{system}\n<|user|>\n{prefix}{user}\n<|assistant|>\n")
+        budget = self.n_ctx - fixed - max_tokens - 8
+        if self.turn_budget is not None:
+            budget = min(budget, self.turn_budget)
+        sizes = [self.count_tokens(text) for text, _ in self.turns]
+        total = sum(sizes)
+        if total <= budget:
+            return
+        target = int(max(0, budget) * 0.75)
+        drop = 0
+        while drop < len(sizes) and total > target:
+            total -= sizes[drop]
+            drop += 1
+        evicted = self.turns[:drop]
+        self.turns = self.turns[drop:]
+        self.turns_evicted += drop
+        if self.on_evict is not None:
+            self.on_evict([text for text, _ in evicted])
+
+    def _prompt_tokens(self, system: str, user: str, prefix: str, with_turns: bool, max_tokens: int) -> List[int]:
+        head, state = self._cached_prefix(system, prefix)
+        tail = self._tokenize(f"{user}\n<|assistant|>\n", add_bos=False)
+        body: List[int] = []
+        if with_turns:
+            self._fit_turns(head, len(tail), max_tokens)
+            for _, t in self.turns:
+                body.extend(t)
+        if self._reused_tokens(head) < len(head):
+            # another prompt overwrote the KV cache since: restore the snapshot
+            self.llm.load_state(state)
+            self.prefix_restores += 1
+        return head + body + tail
+
+    def generate_json(self, system: str, user: str, max_tokens: int = 90,
+                      cancel: Optional[CancelToken] = None, prefix: str = "",
+                      with_turns: bool = False,
+                      on_say_now: Optional[Callable[[str], None]] = None,
+                      grammar: Optional[str] = None) -> Dict[str, Any]:
+        """
+        `prefix` is the static start of the user message (reused through the KV snapshot),
+        followed by the session turns when `with_turns` is set, then `user`.
+        `cancel` is checked between chunks of prompt evaluation and between generated tokens.
+        `on_say_now` is called (on this thread) with the say_now text generated so far.
+        `grammar` is GBNF source for the reply; it is compiled once and reused.
+        """
         if not self.ready or self.llm is None:
             raise RuntimeError("LLM is not ready. Ensure model is properly loaded.")
         
-        prompt = f"<|system|>\n{system}\n<|user|>\n{user}\n<|assistant|>\n"
-        try:
-            out = self.llm(
-                prompt,
-                max_tokens=max_tokens,
-                temperature=0.2,
-                top_p=0.9,
-                stop=["<|user|>", "<|system|>"]
-            )
-            text = out["choices"][0]["text"]
-            return safe_json_extract(text)
-        except Exception as e:
-            raise RuntimeError(f"Error generating response: {e}")
+        if cancel is not None and cancel.cancelled:
+            self.cancel_stats.record(max_tokens * self.ms_per_token)
+            return {}
+
+        t_start = time.perf_counter()
+        with self._lock:
+            prompt = None
+            if self._prefix_ok:
+                try:
+                    prompt = self._prompt_tokens(system, user, prefix, with_turns, max_tokens)
+                    self.last_prompt_tokens = len(prompt)
+                    # llama-cpp skips the longest prefix already in the KV cache
+                    self.last_eval_tokens = len(prompt) - self._reused_tokens(prompt)
+                except Exception:
+                    self._prefix_ok = False
+                    self._prefixes.clear()
+                    prompt = None
+            if prompt is None:
+                if with_turns:
+                    self._fit_text_turns(system, user, prefix, max_tokens)
+                turns = "".join(text for text, _ in self.turns) if with_turns else ""
+                prompt = f"<|system|>\n{system}\n<|user|>\n{prefix}{turns}{user}\n<|assistant|>\n"
+            elif cancel is not None:
+                # evaluate the prompt up front so a cancel does not wait for all of it;
+                # the call below then only evaluates the last token
+                try:
+                    ok = self._eval_chunked(prompt[:-1], cancel)
+                except Exception:
+                    ok = True
+                if not ok:
+                    self.cancel_stats.record(max_tokens * self.ms_per_token)
+                    self.last_used = time.monotonic()
+                    return {}
+
+            try:
+                parts = []
+                t_first = None
+                said = ""
+                end = _ObjectEnd()
+                for chunk in self.llm(
+                    prompt,
+                    max_tokens=max_tokens,
+                    temperature=0.2,
+                    top_p=0.9,
+                    stop=["<|user|>", "<|system|>"],
+                    stream=True,
+                    grammar=self._grammar(grammar)
+                ):
+                    if cancel is not None and cancel.cancelled:
+                        self.cancel_stats.record((max_tokens - len(parts)) * self.ms_per_token)
+                        return {}
+                    if t_first is None:
+                        t_first = time.perf_counter()
+                    parts.append(chunk["choices"][0]["text"])
+                    if on_say_now is not None:
+                        say = partial_json_string("".join(parts), "say_now")
+                        if say and say.strip() and say != said:
+                            if not said:
+                                self.first_say_ms = (time.perf_counter() - t_start) * 1000.0
+                            said = say
+                            on_say_now(say)
+                    if end.feed(parts[-1]):
+                        if len(parts) < max_tokens:
+                            self.early_stops += 1
+                        break
+                if t_first is not None and len(parts) > 1:
+                    per_token = (time.perf_counter() - t_first) * 1000.0 / (len(parts) - 1)
+                    self.ms_per_token = 0.8 * self.ms_per_token + 0.2 * per_token
+                out = safe_json_extract("".join(parts))
+                if not out:
+                    self.json_failures += 1
+                return out
+            except Exception as e:
+                raise RuntimeError(f"Error generating response: {e}")
+            finally:
+                self.last_used = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "prefix_builds": self.prefix_builds,
+            "prefix_restores": self.prefix_restores,
+            "last_prompt_tokens": self.last_prompt_tokens,
+            "last_eval_tokens": self.last_eval_tokens,
+            "turns": len(self.turns),
+            "turn_tokens": self.turn_tokens(),
+            "token_count_cache": self._token_counts.stats(),
+            "turns_evicted": self.turns_evicted,
+            "kv_shifts": self.kv_shifts,
+            "first_say_ms": self.first_say_ms,
+            "early_stops": self.early_stops,
+            "json_failures": self.json_failures,
+            "ms_per_token": self.ms_per_token,
+            "cancel_saved": self.cancel_stats.as_dict(),
+        }
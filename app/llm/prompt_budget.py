@@ -0,0 +1,70 @@
+from typing import Callable, Dict, List
+
+class PromptBudget:
+    """
+    Splits the context window among prompt sections and trims sections to fit.
+
+    `count_tokens` should be the model tokenizer (LLMEngine.count_tokens caches it per
+    string). The window left after the fixed head, the reply (`max_tokens`) and a small
+    margin is shared out by `shares`. Among the sections passed to split() with their
+    needs, one that uses less than its share leaves the rest to the next one (in the
+    order of `shares`); other sections always get exactly their share, so their budget
+    stays stable from one request to the next.
+    """
+    MARGIN = 16
+
+    def __init__(self, count_tokens: Callable[[str], int], n_ctx: int, shares: Dict[str, float]):
+        self.count_tokens = count_tokens
+        self.n_ctx = n_ctx
+        self.shares = dict(shares)
+
+    def available(self, head_tokens: int, max_tokens: int) -> int:
+        return max(0, self.n_ctx - head_tokens - max_tokens - self.MARGIN)
+
+    def split(self, available: int, needs: Dict[str, int]) -> Dict[str, int]:
+        """Per-section token budgets; `needs` is what each section would use untrimmed."""
+        out = {}
+        spare = 0
+        total_share = sum(self.shares.values()) or 1.0
+        for name, share in self.shares.items():
+            budget = int(available * share / total_share)
+            if name in needs:
+                budget += spare
+                spare = max(0, budget - needs[name])
+            out[name] = budget
+        return out
+
+    def fit_text(self, text: str, budget: int, keep_end: bool = False) -> str:
+        """Longest word-aligned start (or end, with keep_end) of `text` within `budget` tokens."""
+        if budget <= 0:
+            return ""
+        if self.count_tokens(text) <= budget:
+            return text
+        words = text.split(" ")
+        lo, hi = 0, len(words)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            cand = " ".join(words[-mid:] if keep_end else words[:mid])
+            if self.count_tokens(cand) <= budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        if lo == 0:
+            return ""
+        return " ".join(words[-lo:] if keep_end else words[:lo])
+
+    def fit_items(self, items: List[str], budget: int, sep: str = "\n") -> List[str]:
+        """Items in priority order while they fit; the first one that doesn't is cut short."""
+        out: List[str] = []
+        left = budget
+        for item in items:
+            n = self.count_tokens(item + sep)
+            if n <= left:
+                out.append(item)
+                left -= n
+                continue
+            cut = self.fit_text(item, left - self.count_tokens(sep))
+            if cut:
+                out.append(cut)
+            break
+        return out
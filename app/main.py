@@ -1,14 +1,21 @@
+import json
 import os
 import queue
+import sys
+import threading
 import time
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
 
 import sounddevice as sd
 
-from app.utils.config import load_config
+from app.utils.config import DOC_CACHE_DIR, load_config
 from app.audio.capture import AudioWorker
-from app.audio.segmenter import pcm_bytes_to_float32
-from app.asr.whisper_asr import ASREngine
+from app.pipeline.dag import TaskGraph
+from app.pipeline.event_queue import EventQueue, release_event
+from app.pipeline.transcript_delta import TranscriptDelta
+from app.asr.whisper_asr import ASREngine, StreamingTranscriber
+from app.asr.asr_service import ASRService
 from app.coach.embedder import Embedder
 from app.coach.translator import TranslatorENES
 from app.rag.pdf_store import DocumentStore
@@ -16,6 +23,7 @@ from app.llm.llm_engine import LLMEngine
 from app.coach.coach import Coach
 from app.ui.overlay import OverlayUI
 from app.ui.config_window import ConfigWindow
+from app.utils.cancel import CancelToken
 
 DEFAULT_CFG = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.default.json")
 
@@ -29,7 +37,8 @@ class App:
         self.overlay = OverlayUI(self.root)
         self.cfg_win = ConfigWindow(self.root, self.cfg, on_apply=self.apply_config)
 
-        self.event_q: queue.Queue = queue.Queue()
+        self.event_q = EventQueue(self.cfg.event_queue_size, self.cfg.event_queue_policy)
+        self.transcript_q: queue.Queue = queue.Queue()
         self.ui_q: queue.Queue = queue.Queue()
 
         self.mic_worker = None
@@ -37,38 +46,76 @@ class App:
 
         self.embedder = Embedder()
         self.translator = TranslatorENES()
-        self.docstore = DocumentStore(self.embedder)
+        self.docstore = DocumentStore(self.embedder, embed_batch_size=self.cfg.doc_embed_batch,
+                                      cache_dir=os.path.abspath(self.cfg.doc_cache_dir or DOC_CACHE_DIR),
+                                      index_kind=self.cfg.doc_index, n_probe=self.cfg.doc_ivf_probe or None,
+                                      retrieval=self.cfg.doc_retrieval)
 
         self.asr = None
+        self.asr_service = None
         self.llm = None
         self.coach = None
 
-        self.last_partial_t = 0
+        self.last_partial_t = {}  # source -> time of last transcribed partial
+        self.delta = TranscriptDelta()
+        self._draft_token = None  # draft suggestion currently running on the coach thread
+        self._draft_for = None    # ((source, utt), HER text) of that draft
+        self._xrun_check_t = 0.0
+        self._footer = {"audio": "", "doc": ""}  # overlay footer lines by topic
 
         # Hotkeys (Tkinter-level)
         self.root.bind_all("<F8>", lambda e: self.overlay.toggle_clickthrough())
         self.root.bind_all("<F9>", lambda e: self.overlay.toggle_visible())
         self.root.bind_all("<F10>", lambda e: self.overlay.set_topmost(True))
+        self.root.bind_all("<F11>", lambda e: self.log_stats())
 
         self.apply_config()
+        # translation, retrieval and the LLM of one transcript run side by side
+        self.coach_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="coach-task")
+        self.coach_thread = threading.Thread(target=self.coach_loop, name="coach", daemon=True)
+        self.coach_thread.start()
         self.root.after(30, self.engine_tick)
         self.root.after(60, self.ui_tick)
+        self.root.after(int(max(self.cfg.stats_log_s, 1.0) * 1000), self.stats_tick)
 
         self.cfg_win.win.deiconify()
 
     def apply_config(self):
+        self.delta.min_edit = max(0, self.cfg.transcript_min_edit)
+
         # Rebuild engines
-        self.asr = ASREngine(self.cfg.asr_model_size, self.cfg.asr_compute_type)
+        if self.asr_service is not None:
+            self.asr_service.stop()
+        self.asr = ASREngine(self.cfg.asr_model_size, self.cfg.asr_compute_type, cpu_threads=self.cfg.asr_threads)
+        draft_asr = None
+        if self.cfg.asr_draft_model_size:
+            draft_asr = ASREngine(self.cfg.asr_draft_model_size, self.cfg.asr_draft_compute_type,
+                                  cpu_threads=self.cfg.asr_draft_threads)
+            if not draft_asr.ready:
+                draft_asr = None
+        stream_asr = StreamingTranscriber(draft_asr or self.asr, sample_rate=self.cfg.sample_rate) if self.cfg.asr_streaming else None
+        self.asr_service = ASRService(self.asr, stream_asr, out_q=self.transcript_q,
+                                      max_pending=self.cfg.event_queue_size, policy=self.cfg.event_queue_policy,
+                                      batch_window_ms=self.cfg.asr_batch_window_ms, max_batch=self.cfg.asr_max_batch,
+                                      draft_asr=draft_asr)
+        self.asr_service.start()
         self.llm = LLMEngine(self.cfg.llm_model_path, self.cfg.llm_ctx, self.cfg.llm_threads)
 
         # PDF load
+        self.docstore.embed_batch_size = self.cfg.doc_embed_batch
+        self.docstore.index_kind = self.cfg.doc_index
+        self.docstore.n_probe = self.cfg.doc_ivf_probe or None
+        self.docstore.retrieval = self.cfg.doc_retrieval
         if self.cfg.enable_document and self.cfg.pdf_path:
-            ok = self.docstore.load_pdf(self.cfg.pdf_path)
+            # indexed in the background; retrieval uses what is ready so far
+            ok = self.docstore.load_pdf_async(self.cfg.pdf_path, on_progress=self._on_doc_progress)
             if not ok:
                 self.ui_q.put({"type":"status","text":"⚠️ No pude cargar el PDF (falta PyMuPDF o ruta inválida)."})
         else:
-            self.docstore.chunks, self.docstore.pages, self.docstore.vecs = [], [], None
+            self.docstore.clear()
 
+        if self.coach is not None:
+            self.coach.close()
         self.coach = Coach(
             profile_context=self.cfg.profile_context,
             goal_context=self.cfg.goal_context,
@@ -78,7 +125,12 @@ class App:
             llm=self.llm,
             embedder=self.embedder,
             docstore=self.docstore,
-            translator=self.translator
+            translator=self.translator,
+            cache_size=self.cfg.coach_cache_size,
+            cache_ttl_s=self.cfg.coach_cache_ttl_s,
+            promote_max_edit=self.cfg.coach_promote_max_edit,
+            summarize=self.cfg.coach_summarize,
+            summary_idle_s=self.cfg.coach_summary_idle_s
         )
 
         # Overlay style
@@ -94,6 +146,16 @@ class App:
         self.stop_workers()
         self.start_workers()
 
+    def _on_doc_progress(self, p):
+        # runs on the ingestion thread; shown in the overlay footer, not over the suggestion
+        if p.get("done"):
+            self.ui_q.put({"type":"footer","topic":"doc","clear_ms":5000,
+                           "text": f"📄 PDF listo: {p.get('chunks', 0)} fragmentos indexados."})
+        else:
+            self.ui_q.put({"type":"footer","topic":"doc",
+                           "text": f"📄 Indexando PDF: página {p.get('pages_done')}/{p.get('pages')} "
+                                   f"({p.get('chunks', 0)} fragmentos)"})
+
     def start_workers(self):
         if self.cfg.mic_device is None or self.cfg.loopback_device is None:
             self.ui_q.put({"type":"status","text":"Configura mic y loopback en Configuración."})
@@ -105,12 +167,41 @@ class App:
         self.loop_worker.start()
         self.ui_q.put({"type":"status","text":"✅ Captura activa (mic + loopback)."})
 
+    def audio_stats(self):
+        return [w.stats() for w in [self.mic_worker, self.loop_worker] if w is not None]
+
+    def stats(self):
+        return {
+            "audio": self.audio_stats(),
+            "events": self.event_q.stats(),
+            "asr": self.asr_service.stats() if self.asr_service is not None else {},
+            "llm": self.llm.stats() if self.llm is not None else {},
+            "coach": self.coach.stats() if self.coach is not None else {},
+            "delta": self.delta.stats(),
+            "embedder": self.embedder.stats(),
+            "ingest": self.docstore.last_ingest,
+        }
+
+    def stats_tick(self):
+        # every stats_log_s seconds (and on F11): one JSON line with the pipeline counters
+        interval = self.cfg.stats_log_s
+        if interval > 0:
+            self.log_stats()
+        self.root.after(int(max(interval, 1.0) * 1000), self.stats_tick)
+
+    def log_stats(self):
+        try:
+            print("stats " + json.dumps(self.stats(), default=str), file=sys.stderr, flush=True)
+        except Exception as e:
+            print(f"stats unavailable: {e}", file=sys.stderr)
+
     def stop_workers(self):
         for w in [self.mic_worker, self.loop_worker]:
             if w is not None:
                 w.stop()
 
     def engine_tick(self):
+        # dispatch only: ASR and coaching run on their own threads
         try:
             for _ in range(40):
                 ev = self.event_q.get_nowait()
@@ -126,53 +217,168 @@ class App:
 
         source = ev.get("source")  # her/me
         kind = ev.get("kind")
-        audio = pcm_bytes_to_float32(ev.get("pcm16", b""))
+        wanted = (source == "her" and kind in ("partial", "final")) or (source == "me" and kind == "final")
+
+        if wanted and kind == "partial":
+            # throttle partials to keep CPU stable
+            t = time.time()
+            if (t - self.last_partial_t.get(source, 0.0)) < 0.7:
+                wanted = False
+            else:
+                self.last_partial_t[source] = t
+
+        if not wanted or self.asr_service is None:
+            # the segment is a view into the worker's ring buffer: hand it back
+            release_event(ev)
+            return
+        self.asr_service.submit(ev).add_done_callback(self._on_asr_done)
 
-        if audio.size == 0 or self.asr is None:
+    def _on_asr_done(self, fut):
+        # runs on the ASR thread: a newer HER transcript makes the running draft stale,
+        # unless the delta stage would skip it anyway or it says the same thing (then the
+        # draft is promoted to the final)
+        if fut.cancelled():
+            return
+        res = fut.result()
+        tok, draft_for, coach = self._draft_token, self._draft_for, self.coach
+        if tok is None or res.get("source") != "her" or not res.get("text"):
             return
+        if draft_for is not None and draft_for[0] == ("her", res.get("utt")):
+            if res.get("kind") == "partial" and not self.delta.would_change(draft_for[0], res["text"]):
+                return
+            if coach is not None and coach.draft_matches(draft_for[1], res["text"]):
+                return
+        tok.cancel()
+
+    def coach_loop(self):
+        while True:
+            res = self.transcript_q.get()
+            try:
+                self.handle_transcript(res)
+            except Exception as e:
+                self.ui_q.put({"type":"status","text": f"⚠️ Coach error: {e}"})
+
+    def handle_transcript(self, res):
+        txt = res.get("text")
+        if not txt or self.coach is None:
+            return
+
+        source = res.get("source")  # her/me
+        kind = res.get("kind")
+        key = (source, res.get("utt"))
 
         if source == "her":
             if kind == "partial":
-                # throttle partials to keep CPU stable
-                t = time.time()
-                if (t - self.last_partial_t) < 0.7:
-                    return
-                self.last_partial_t = t
-
-                txt = self.asr.transcribe(audio)
-                if txt:
-                    sug = self.coach.suggest_draft(txt)
-                    es = self.coach.maybe_translate_her(txt)
-                    self.ui_q.put({"type":"her","phase":"partial","en":txt,"es":es,"suggest":sug})
+                if not self.transcript_q.empty():
+                    return  # a newer transcript is already waiting
+                if not self.delta.changed(key, txt):
+                    return  # same content as the last partial we coached on
+                tok = CancelToken()
+                self._draft_for = (key, txt)
+                self._draft_token = tok
+                try:
+                    self.coach_her(txt, "partial", res.get("utt"), cancel=tok)
+                finally:
+                    self._draft_token = None
+                    self._draft_for = None
 
             elif kind == "final":
-                txt = self.asr.transcribe(audio)
-                if txt:
-                    sug = self.coach.suggest_final(txt)
-                    es = self.coach.maybe_translate_her(txt)
-                    self.ui_q.put({"type":"her","phase":"final","en":txt,"es":es,"suggest":sug})
+                self.delta.reset(key)
+                self.coach_her(txt, "final", res.get("utt"))
 
         elif source == "me":
             if kind == "final":
-                txt = self.asr.transcribe(audio)
-                if txt:
-                    evl = self.coach.evaluate_me(txt)
-                    self.ui_q.put({"type":"me","en":txt,"eval":evl})
+                evl = self.coach.evaluate_me(txt)
+                self.ui_q.put({"type":"me","en":txt,"eval":evl})
+
+    def coach_her(self, txt, phase, utt, cancel=None):
+        # translation starts right away; retrieval -> LLM runs next to it. The overlay
+        # is redrawn as each result (and each streamed say_now word) lands.
+        coach = self.coach
+        view = {"type":"her","phase":phase,"en":txt,"es":"","suggest":{}}
+        lock = threading.Lock()
+
+        def post(streaming=False, **update):
+            if cancel is not None and cancel.cancelled:
+                return
+            with lock:
+                view.update(update)
+                msg = dict(view)
+            if streaming:
+                msg["streaming"] = True
+            self.ui_q.put(msg)
+
+        def on_result(name, value):
+            if name == "translate" and value:
+                post(es=value)
+            elif name == "suggest":
+                post(suggest=value or {})
+
+        def on_say_now(say):
+            post(streaming=True, suggest={"say_now": say})
+
+        graph = TaskGraph(self.coach_pool)
+        graph.add("translate", lambda: coach.maybe_translate_her(txt))
+        if phase == "final":
+            graph.add("doc", lambda: "" if coach.promotable(txt, utt) else coach.retrieve_doc(txt))
+            graph.add("suggest", lambda doc: coach.suggest_final(txt, on_say_now=on_say_now, utt=utt, doc_ctx=doc),
+                      deps=("doc",))
+        else:
+            graph.add("doc", lambda: coach.retrieve_doc(txt))
+            graph.add("suggest", lambda doc: coach.suggest_draft(txt, cancel=cancel, on_say_now=on_say_now,
+                                                                 utt=utt, doc_ctx=doc),
+                      deps=("doc",))
+        graph.run(on_result)
+
+        err = graph.errors.get("doc") or graph.errors.get("suggest")
+        if err is not None:
+            raise err
 
     def ui_tick(self):
         try:
             while True:
                 msg = self.ui_q.get_nowait()
+                if msg.get("streaming") and not self.ui_q.empty():
+                    continue  # a newer message is queued: only the latest stream text is drawn
                 self.render(msg)
         except queue.Empty:
             pass
+        self.check_audio_health()
         self.root.after(60, self.ui_tick)
 
+    def check_audio_health(self):
+        # xruns are polled from the workers' counters once a second and shown in the
+        # overlay footer, so they never displace a suggestion or an audio event
+        t = time.monotonic()
+        if t - self._xrun_check_t < 1.0:
+            return
+        self._xrun_check_t = t
+        lines = [f"⚠️ Audio {st['source']}: {st['xruns']} xruns, {st['ring_dropped']} bloques perdidos"
+                 for st in self.audio_stats() if st["xruns"] or st["ring_dropped"]]
+        self.set_footer("audio", "\n".join(lines))
+
+    def set_footer(self, topic, text):
+        if self._footer.get(topic) == text:
+            return
+        self._footer[topic] = text
+        self.overlay.set_footer("\n".join(t for t in self._footer.values() if t))
+
+    def _clear_footer(self, topic, text):
+        if self._footer.get(topic) == text:
+            self.set_footer(topic, "")
+
     def render(self, msg):
         if msg.get("type") == "status":
             self.overlay.set_text(msg.get("text", ""))
             return
 
+        if msg.get("type") == "footer":
+            text = msg.get("text", "")
+            self.set_footer(msg.get("topic", "status"), text)
+            if msg.get("clear_ms"):
+                self.root.after(msg["clear_ms"], lambda: self._clear_footer(msg.get("topic", "status"), text))
+            return
+
         if msg.get("type") == "her":
             en = msg.get("en", "")
             es = msg.get("es", "")
@@ -0,0 +1,91 @@
+import threading
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+class TaskGraph:
+    """
+    Small DAG of callables run on a shared executor.
+
+    add() registers a node that depends on earlier nodes; its callable receives the
+    dependency results as positional arguments, in order. run() starts every node as
+    soon as its dependencies are done, calls `on_result(name, value)` as each one
+    lands (on the worker thread that ran it) and returns all results once the graph
+    has drained. A node that raises is recorded in `errors`; nodes depending on it
+    are skipped.
+    """
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self._nodes: Dict[str, Tuple[Callable[..., Any], Tuple[str, ...]]] = {}
+        self.results: Dict[str, Any] = {}
+        self.errors: Dict[str, BaseException] = {}
+
+    def add(self, name: str, fn: Callable[..., Any], deps: Sequence[str] = ()) -> "TaskGraph":
+        if name in self._nodes:
+            raise ValueError(f"Duplicate task: {name}")
+        for d in deps:
+            if d not in self._nodes:
+                raise ValueError(f"Task {name} depends on unknown task {d}")
+        self._nodes[name] = (fn, tuple(deps))
+        return self
+
+    def run(self, on_result: Optional[Callable[[str, Any], Any]] = None,
+            timeout: Optional[float] = None) -> Dict[str, Any]:
+        lock = threading.Lock()
+        done = threading.Event()
+        waiting = {name: set(deps) for name, (_fn, deps) in self._nodes.items()}
+        dependents: Dict[str, List[str]] = {name: [] for name in self._nodes}
+        for name, (_fn, deps) in self._nodes.items():
+            for d in deps:
+                dependents[d].append(name)
+        remaining = [len(self._nodes)]
+
+        def finish(name: str):
+            # called with `lock` held
+            remaining[0] -= 1
+            ready = []
+            for child in dependents[name]:
+                if name in self.errors or child in self.errors:
+                    if child not in self.errors:
+                        self.errors[child] = RuntimeError(f"skipped: {name} failed")
+                        waiting[child].clear()
+                        finish(child)
+                    continue
+                waiting[child].discard(name)
+                if not waiting[child]:
+                    ready.append(child)
+            if remaining[0] == 0:
+                done.set()
+            return ready
+
+        def start(name: str):
+            fn, deps = self._nodes[name]
+            args = [self.results[d] for d in deps]
+            self.executor.submit(execute, name, fn, args)
+
+        def execute(name: str, fn: Callable[..., Any], args: List[Any]):
+            try:
+                value = fn(*args)
+                failed = None
+            except BaseException as e:
+                value, failed = None, e
+            if failed is None and on_result is not None:
+                try:
+                    on_result(name, value)
+                except Exception:
+                    pass
+            with lock:
+                if failed is None:
+                    self.results[name] = value
+                else:
+                    self.errors[name] = failed
+                ready = finish(name)
+            for child in ready:
+                start(child)
+
+        if not self._nodes:
+            return self.results
+        roots = [name for name, deps in waiting.items() if not deps]
+        for name in roots:
+            start(name)
+        done.wait(timeout)
+        return self.results
@@ -0,0 +1,141 @@
+import queue
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+def release_event(ev: Dict[str, Any]):
+    seg = ev.get("segment")
+    if seg is not None:
+        seg.release()
+
+class EventQueue:
+    """
+    Bounded audio-event queue that coalesces stale partials.
+
+    - a newer partial from a source replaces the partial still queued for that source;
+    - a final removes any queued partial of the same utterance;
+    - when full, `policy` decides: "drop_oldest" evicts the oldest partial (or, if there
+      is none, the oldest event), "drop_newest" rejects the incoming event and "block"
+      waits for room.
+
+    Discarded events go through `on_discard` so their ring segments are released.
+    Drop-in for the queue.Queue calls used by AudioWorker and App.
+    """
+    POLICIES = ("drop_oldest", "drop_newest", "block")
+
+    def __init__(self, maxsize: int = 16, policy: str = "drop_oldest",
+                 on_discard: Optional[Callable[[Dict[str, Any]], None]] = release_event):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown event queue policy: {policy}")
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.on_discard = on_discard
+
+        self._q: Deque[Dict[str, Any]] = deque()
+        self._cond = threading.Condition()
+
+        self.put_count = 0
+        self.coalesced = 0
+        self.cancelled = 0
+        self.dropped = 0
+
+    def _discard(self, ev: Dict[str, Any]):
+        if self.on_discard is not None:
+            try:
+                self.on_discard(ev)
+            except Exception:
+                pass
+
+    def _coalesce(self, ev: Dict[str, Any]) -> bool:
+        """Apply supersession rules. Returns True if `ev` took over a queued slot."""
+        kind = ev.get("kind")
+        source = ev.get("source")
+        if kind == "partial":
+            for i, old in enumerate(self._q):
+                if old.get("kind") == "partial" and old.get("source") == source:
+                    self._q[i] = ev
+                    self.coalesced += 1
+                    self._discard(old)
+                    return True
+        elif kind == "final":
+            utt = ev.get("utt")
+            stale = [old for old in self._q
+                     if old.get("kind") == "partial" and old.get("source") == source and old.get("utt") == utt]
+            for old in stale:
+                self._q.remove(old)
+                self.cancelled += 1
+                self._discard(old)
+        return False
+
+    def _make_room(self):
+        for old in self._q:
+            if old.get("kind") == "partial":
+                self._q.remove(old)
+                break
+        else:
+            old = self._q.popleft()
+        self.dropped += 1
+        self._discard(old)
+
+    def put(self, ev: Dict[str, Any], block: bool = True, timeout: Optional[float] = None):
+        with self._cond:
+            self.put_count += 1
+            if self._coalesce(ev):
+                self._cond.notify()
+                return
+
+            if len(self._q) >= self.maxsize:
+                if self.policy == "drop_newest" or (self.policy == "block" and not block):
+                    self.dropped += 1
+                    self._discard(ev)
+                    return
+                if self.policy == "block":
+                    if not self._cond.wait_for(lambda: len(self._q) < self.maxsize, timeout):
+                        self.dropped += 1
+                        self._discard(ev)
+                        return
+                else:
+                    self._make_room()
+
+            self._q.append(ev)
+            self._cond.notify()
+
+    def put_nowait(self, ev: Dict[str, Any]):
+        self.put(ev, block=False)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Dict[str, Any]:
+        with self._cond:
+            if not block:
+                if not self._q:
+                    raise queue.Empty
+            elif not self._cond.wait_for(lambda: len(self._q) > 0, timeout):
+                raise queue.Empty
+            ev = self._q.popleft()
+            self._cond.notify_all()
+            return ev
+
+    def get_nowait(self) -> Dict[str, Any]:
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        with self._cond:
+            return len(self._q)
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def clear(self):
+        with self._cond:
+            while self._q:
+                self._discard(self._q.popleft())
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "depth": len(self._q),
+                "put": self.put_count,
+                "coalesced": self.coalesced,
+                "cancelled": self.cancelled,
+                "dropped": self.dropped,
+            }
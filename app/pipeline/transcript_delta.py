@@ -0,0 +1,81 @@
+import re
+import threading
+from typing import Any, Dict, Hashable
+
+FILLERS = frozenset({"um", "umm", "uh", "uhm", "erm", "er", "ah", "eh", "hmm", "mm", "mhm"})
+
+def normalize_transcript(text: str) -> str:
+    """Lower-case words without punctuation or filler words."""
+    words = re.sub(r"[^\w\s']", " ", text.lower()).split()
+    return " ".join(w for w in words if w not in FILLERS)
+
+def edit_distance_at_least(a: str, b: str, k: int) -> bool:
+    """True if the Levenshtein distance between a and b is >= k (banded, O(len * k))."""
+    if k <= 0:
+        return True
+    if abs(len(a) - len(b)) >= k:
+        return True
+    if a == b:
+        return False
+
+    big = k + 1
+    prev = [j if j <= k else big for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        lo = max(1, i - k)
+        hi = min(len(b), i + k)
+        cur = [big] * (len(b) + 1)
+        cur[0] = i if i <= k else big
+        ca = a[i - 1]
+        row_min = cur[0]
+        for j in range(lo, hi + 1):
+            cost = 0 if ca == b[j - 1] else 1
+            v = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            cur[j] = v
+            if v < row_min:
+                row_min = v
+        if row_min >= k:
+            return True
+        prev = cur
+    return prev[len(b)] >= k
+
+class TranscriptDelta:
+    """
+    Decides whether a partial transcript changed enough to be worth more work.
+
+    Each partial is compared with the last partial of the same key (source, utterance)
+    that was let through, after normalize_transcript(); it passes when they differ by at
+    least `min_edit` characters. Small drifts therefore add up until they matter.
+    """
+    def __init__(self, min_edit: int = 3):
+        self.min_edit = max(0, min_edit)
+        self._lock = threading.Lock()
+        self._last: Dict[Hashable, str] = {}
+
+        self.checked = 0
+        self.skipped = 0
+
+    def changed(self, key: Hashable, text: str) -> bool:
+        norm = normalize_transcript(text)
+        with self._lock:
+            self.checked += 1
+            last = self._last.get(key)
+            if not norm or (last is not None and not edit_distance_at_least(norm, last, self.min_edit)):
+                self.skipped += 1
+                return False
+            self._last[key] = norm
+            return True
+
+    def would_change(self, key: Hashable, text: str) -> bool:
+        """changed() without recording anything."""
+        norm = normalize_transcript(text)
+        with self._lock:
+            last = self._last.get(key)
+        return bool(norm) and (last is None or edit_distance_at_least(norm, last, self.min_edit))
+
+    def reset(self, key: Hashable):
+        with self._lock:
+            self._last.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"checked": self.checked, "skipped": self.skipped, "passed": self.checked - self.skipped}
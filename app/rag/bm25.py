@@ -0,0 +1,141 @@
+import math
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.rag.vector_index import _top_k
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._/\-+][a-z0-9]+)*")
+_SPLIT_RE = re.compile(r"[._/\-+]")
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it its of on or that the this "
+    "to was were will with you your we our they their".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-case terms without stop words. Compound terms such as product names or
+    versions ("wi-fi", "v2.1", "tcp/ip") are kept whole, joined ("wifi") and split into
+    their parts.
+    """
+    out = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        if tok in STOP_WORDS:
+            continue
+        out.append(tok)
+        if not tok.isalnum():
+            parts = [p for p in _SPLIT_RE.split(tok) if p]
+            out.append("".join(parts))  # "wi-fi" also matches "wifi"
+            out.extend(p for p in parts if p not in STOP_WORDS)
+    return out
+
+class _Segment:
+    """Immutable postings for a contiguous range of documents."""
+    __slots__ = ("base", "n", "postings", "lengths")
+
+    def __init__(self, base: int, n: int, postings: Dict[str, Tuple[np.ndarray, np.ndarray]], lengths: np.ndarray):
+        self.base = base
+        self.n = n
+        self.postings = postings  # term -> (global doc ids, term frequencies)
+        self.lengths = lengths
+
+    @classmethod
+    def build(cls, base: int, docs: Sequence[List[str]]) -> "_Segment":
+        acc: Dict[str, Tuple[List[int], List[int]]] = {}
+        for i, terms in enumerate(docs):
+            counts: Dict[str, int] = {}
+            for t in terms:
+                counts[t] = counts.get(t, 0) + 1
+            for t, c in counts.items():
+                ids, tfs = acc.setdefault(t, ([], []))
+                ids.append(base + i)
+                tfs.append(c)
+        postings = {t: (np.asarray(ids, dtype=np.int64), np.asarray(tfs, dtype=np.float32))
+                    for t, (ids, tfs) in acc.items()}
+        return cls(base, len(docs), postings, np.asarray([len(d) for d in docs], dtype=np.float32))
+
+    @classmethod
+    def merge(cls, a: "_Segment", b: "_Segment") -> "_Segment":
+        postings = dict(a.postings)
+        for t, (ids, tfs) in b.postings.items():
+            prev = postings.get(t)
+            postings[t] = (ids, tfs) if prev is None else (np.concatenate([prev[0], ids]),
+                                                           np.concatenate([prev[1], tfs]))
+        return cls(a.base, a.n + b.n, postings, np.concatenate([a.lengths, b.lengths]))
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index, built at ingest time.
+
+    The index is immutable: add() returns a new index that shares the existing postings
+    and appends a segment for the new documents, so snapshots published while a
+    document is still ingesting stay valid. Segments are merged logarithmically (a new
+    one is merged into its predecessor while that is at most twice its size), which keeps
+    them few; compact() merges everything once ingestion is done.
+    """
+    def __init__(self, segments: Tuple[_Segment, ...] = (), k1: float = 1.5, b: float = 0.75):
+        self.segments = segments
+        self.k1 = k1
+        self.b = b
+        self.n_docs = sum(s.n for s in segments)
+        self.lengths = (np.concatenate([s.lengths for s in segments]) if len(segments) > 1
+                        else segments[0].lengths if segments else np.zeros(0, dtype=np.float32))
+        self.avg_len = float(self.lengths.mean()) if self.n_docs else 0.0
+
+    def add(self, texts: Iterable[str]) -> "BM25Index":
+        docs = [tokenize(t) for t in texts]
+        if not docs:
+            return self
+        segs = list(self.segments) + [_Segment.build(self.n_docs, docs)]
+        while len(segs) >= 2 and segs[-2].n <= 2 * segs[-1].n:
+            last = segs.pop()
+            segs[-1] = _Segment.merge(segs[-1], last)
+        return BM25Index(tuple(segs), self.k1, self.b)
+
+    def compact(self) -> "BM25Index":
+        if len(self.segments) <= 1:
+            return self
+        merged = self.segments[0]
+        for s in self.segments[1:]:
+            merged = _Segment.merge(merged, s)
+        return BM25Index((merged,), self.k1, self.b)
+
+    def scores(self, query: str) -> Optional[np.ndarray]:
+        """BM25 score of every document, or None if no query term is indexed."""
+        terms = set(tokenize(query))
+        if not terms or not self.n_docs:
+            return None
+        out = np.zeros(self.n_docs, dtype=np.float32)
+        norm = self.k1 * (1.0 - self.b + self.b * self.lengths / max(self.avg_len, 1e-9))
+        found = False
+        for t in terms:
+            lists = [s.postings[t] for s in self.segments if t in s.postings]
+            if not lists:
+                continue
+            found = True
+            df = sum(ids.shape[0] for ids, _ in lists)
+            idf = math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            for ids, tfs in lists:
+                out[ids] += idf * tfs * (self.k1 + 1.0) / (tfs + norm[ids])
+        return out if found else None
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(doc ids, scores) of the top `k` documents with a non-zero score, best first."""
+        s = self.scores(query)
+        if s is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        hit = np.flatnonzero(s)
+        idx, top = _top_k(s[hit], k)
+        return hit[idx], top
+
+def rrf_fuse(rankings: Sequence[np.ndarray], k: int, c: int = 60) -> Tuple[np.ndarray, np.ndarray]:
+    """Reciprocal-rank fusion of ranked doc-id lists: score = sum(1 / (c + rank))."""
+    fused: Dict[int, float] = {}
+    for ranked in rankings:
+        for rank, doc in enumerate(ranked.tolist()):
+            fused[doc] = fused.get(doc, 0.0) + 1.0 / (c + rank + 1)
+    best = sorted(fused.items(), key=lambda x: x[1], reverse=True)[:k]
+    return (np.asarray([d for d, _ in best], dtype=np.int64),
+            np.asarray([s for _, s in best], dtype=np.float32))
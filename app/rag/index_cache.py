@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+class IndexCache:
+    """
+    On-disk cache of parsed and embedded documents.
+
+    An entry is keyed by the file content hash, the chunking parameters and the
+    embedder model name, and holds `chunks.json` (chunk text and pages) plus
+    `vecs.npy`, which is opened memory-mapped so reopening a known document costs
+    a file read of the text only. Entries are written to a temporary directory and
+    renamed into place, so a crash never leaves a half-written entry behind.
+    """
+    VERSION = 1
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def key(self, path: str, chunk_chars: int, overlap: int, model_name: str) -> str:
+        params = f"v{self.VERSION}|{self.file_hash(path)}|{chunk_chars}|{overlap}|{model_name}"
+        return hashlib.sha256(params.encode("utf-8")).hexdigest()[:32]
+
+    def load(self, key: str) -> Optional[Tuple[List[str], List[int], np.ndarray]]:
+        d = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(d, "chunks.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            vecs = np.load(os.path.join(d, "vecs.npy"), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        chunks, pages = meta.get("chunks") or [], meta.get("pages") or []
+        if len(chunks) != len(pages) or vecs.shape[0] != len(chunks):
+            return None
+        return chunks, pages, vecs
+
+    def save(self, key: str, chunks: List[str], pages: List[int], vecs: np.ndarray) -> bool:
+        d = os.path.join(self.root, key)
+        tmp = None
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp = tempfile.mkdtemp(prefix=f".{key}-", dir=self.root)
+            with open(os.path.join(tmp, "chunks.json"), "w", encoding="utf-8") as f:
+                json.dump({"chunks": chunks, "pages": pages}, f, ensure_ascii=False)
+            np.save(os.path.join(tmp, "vecs.npy"), np.ascontiguousarray(vecs, dtype=np.float32))
+            if os.path.isdir(d):
+                shutil.rmtree(d, ignore_errors=True)
+            os.replace(tmp, d)
+            return True
+        except OSError:
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+            return False
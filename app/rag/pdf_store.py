@@ -1,5 +1,7 @@
 import os
-from typing import List, Tuple, Optional
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple, Optional
 import numpy as np
 
 try:
@@ -8,43 +10,209 @@ except Exception:
     fitz = None
 
 from app.coach.embedder import Embedder
+from app.rag.bm25 import BM25Index, rrf_fuse
+from app.rag.index_cache import IndexCache
+from app.rag.vector_index import FlatIndex, build_index
 
 class DocumentStore:
-    def __init__(self, embedder: Embedder):
+    """
+    Chunked PDF text with MiniLM vectors for retrieval.
+
+    The index is one (chunks, pages, vecs, vector index, BM25 index) snapshot that is
+    replaced as a whole, so retrieval on another thread always sees a consistent set. load_pdf_async()
+    indexes on a background thread page by page and publishes a new snapshot after
+    every batch of chunks: retrieval works on whatever has been indexed so far.
+
+    Vector search goes through app.rag.vector_index: exact flat search while ingesting,
+    then the `index_kind` index ("flat", "ivf" or "auto") once the document is complete.
+    A BM25 inverted index (app.rag.bm25) is built alongside. `retrieval` picks "vector"
+    (BM25 only without embeddings), "bm25", or "hybrid" (reciprocal-rank fusion of both,
+    which helps with product names and acronyms the embedder does not know).
+    """
+    CHUNK_CHARS = 1400
+    CHUNK_OVERLAP = 200
+    FUSE_DEPTH = 4  # hybrid mode fuses the top k * FUSE_DEPTH of each ranking
+
+    def __init__(self, embedder: Embedder, embed_batch_size: int = 32, cache_dir: Optional[str] = None,
+                 index_kind: str = "auto", n_probe: Optional[int] = None, retrieval: str = "vector"):
         self.embedder = embedder
-        self.chunks: List[str] = []
-        self.pages: List[int] = []
-        self.vecs: Optional[np.ndarray] = None
+        self.embed_batch_size = embed_batch_size
+        # parsed + embedded documents are reused from disk when the file is unchanged
+        self.index_cache = IndexCache(cache_dir) if cache_dir else None
+        self.index_kind = index_kind
+        self.n_probe = n_probe
+        self.retrieval = retrieval
+        self._index: Tuple[List[str], List[int], Optional[np.ndarray], Any, Optional[BM25Index]] = \
+            ([], [], None, None, None)
+        self._gen = 0  # bumped to abandon a running ingestion
+        self._lock = threading.Lock()
+        self.last_ingest: Dict[str, Any] = {}
+
+    # the current snapshot; assigning a field replaces the snapshot too
+    @property
+    def chunks(self) -> List[str]:
+        return self._index[0]
+
+    @chunks.setter
+    def chunks(self, value: List[str]):
+        lexical = BM25Index().add(value).compact()
+        self._index = (value, self._index[1], self._index[2], self._index[3], lexical)
+
+    @property
+    def pages(self) -> List[int]:
+        return self._index[1]
+
+    @pages.setter
+    def pages(self, value: List[int]):
+        self._index = (self._index[0], value, self._index[2], self._index[3], self._index[4])
+
+    @property
+    def vecs(self) -> Optional[np.ndarray]:
+        return self._index[2]
+
+    @vecs.setter
+    def vecs(self, value: Optional[np.ndarray]):
+        self._index = (self._index[0], self._index[1], value, None, self._index[4])
+
+    def clear(self):
+        with self._lock:
+            self._gen += 1
+        self._index = ([], [], None, None, None)
 
     def load_pdf(self, pdf_path: str) -> bool:
-        if not pdf_path or not os.path.exists(pdf_path):
+        """Index `pdf_path` on the calling thread."""
+        if not pdf_path or not os.path.exists(pdf_path) or fitz is None:
+            return False
+        with self._lock:
+            self._gen += 1
+            gen = self._gen
+        return self._ingest(pdf_path, gen, None)
+
+    def load_pdf_async(self, pdf_path: str,
+                       on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> bool:
+        """
+        Index `pdf_path` on a background thread, replacing the current document.
+        `on_progress` gets {pages_done, pages, chunks, done} after each published batch.
+        """
+        if not pdf_path or not os.path.exists(pdf_path) or fitz is None:
             return False
-        if fitz is None:
+        with self._lock:
+            self._gen += 1
+            gen = self._gen
+        self._index = ([], [], None, None, None)
+        threading.Thread(target=self._ingest, args=(pdf_path, gen, on_progress),
+                         name="pdf-ingest", daemon=True).start()
+        return True
+
+    def _publish(self, gen: int, chunks: List[str], pages: List[int], vecs: Optional[np.ndarray],
+                 lexical: Optional[BM25Index], final: bool = False, index: Any = None) -> bool:
+        """`index` is a vector index already built over `vecs`; built here if None."""
+        if index is None and vecs is not None and vecs.shape[0]:
+            index = build_index(vecs, self.index_kind, self.n_probe) if final else FlatIndex(vecs)
+        with self._lock:
+            if gen != self._gen:
+                return False
+            self._index = (chunks, pages, vecs, index, lexical)
+            return True
+
+    def _ingest(self, pdf_path: str, gen: int,
+                on_progress: Optional[Callable[[Dict[str, Any]], None]]) -> bool:
+        def progress(pages_done: int, n_pages: int, n_chunks: int, done: bool):
+            if on_progress is not None:
+                try:
+                    on_progress({"pages_done": pages_done, "pages": n_pages, "chunks": n_chunks, "done": done})
+                except Exception:
+                    pass
+
+        t0 = time.perf_counter()
+        key = None
+        if self.index_cache is not None and self.embedder.model is not None:
+            key = self.index_cache.key(pdf_path, self.CHUNK_CHARS, self.CHUNK_OVERLAP, self.embedder.model_name)
+            hit = self.index_cache.load(key)
+            if hit is not None:
+                index = build_index(hit[2], self.index_kind, self.n_probe) if hit[2].shape[0] else None
+                if not self._publish(gen, *hit, None, final=True, index=index):
+                    return False
+                load_ms = (time.perf_counter() - t0) * 1000.0
+                progress(0, 0, len(hit[0]), True)
+                # vector search is live already; the BM25 index is rebuilt from the chunk text
+                tl = time.perf_counter()
+                lexical = BM25Index().add(hit[0]).compact()
+                if not self._publish(gen, *hit, lexical, final=True, index=index):
+                    return False
+                self.last_ingest = {
+                    "chunks": len(hit[0]),
+                    "cached": True,
+                    "load_ms": load_ms,
+                    "bm25_ms": (time.perf_counter() - tl) * 1000.0,
+                }
+                return True
+
+        try:
+            doc = fitz.open(pdf_path)
+        except Exception:
             return False
+        n_pages = len(doc)
+        embed = self.embedder.model is not None
+        dim = self.embedder.dim if embed else 0
 
-        doc = fitz.open(pdf_path)
-        chunks, pages = [], []
-        for p in range(len(doc)):
+        chunks: List[str] = []
+        pages: List[int] = []
+        vecs = np.empty((max(64, n_pages), dim), dtype=np.float32) if embed else None
+        n_vec = 0
+        embed_s = 0.0
+        lexical = BM25Index()
+        n_lex = 0
+        bm25_s = 0.0
+
+        for p in range(n_pages):
+            if gen != self._gen:
+                return False
             text = doc[p].get_text("text").strip()
-            if not text:
+            if text:
+                for part in self._chunk_text(text, chunk_chars=self.CHUNK_CHARS, overlap=self.CHUNK_OVERLAP):
+                    chunks.append(part)
+                    pages.append(p + 1)
+
+            last = p == n_pages - 1
+            if len(chunks) - n_lex < self.embed_batch_size and not last:
                 continue
-            for part in self._chunk_text(text, chunk_chars=1400, overlap=200):
-                chunks.append(part)
-                pages.append(p + 1)
-
-        self.chunks = chunks
-        self.pages = pages
-
-        if self.embedder.model is not None and self.chunks:
-            vec_list = []
-            for c in self.chunks:
-                v = self.embedder.encode(c)
-                if v is not None:
-                    vec_list.append(v)
-            self.vecs = np.stack(vec_list, axis=0) if vec_list else None
-        else:
-            self.vecs = None
+            if embed and len(chunks) > n_vec:
+                if len(chunks) > vecs.shape[0]:
+                    grown = np.empty((max(len(chunks), 2 * vecs.shape[0]), dim), dtype=np.float32)
+                    grown[:n_vec] = vecs[:n_vec]
+                    vecs = grown  # published snapshots keep the old matrix
+                te = time.perf_counter()
+                self.embedder.encode_into(chunks[n_vec:], out=vecs[n_vec: len(chunks)],
+                                          batch_size=self.embed_batch_size)
+                embed_s += time.perf_counter() - te
+                n_vec = len(chunks)
+            tl = time.perf_counter()
+            lexical = lexical.add(chunks[n_lex:])
+            if last:
+                lexical = lexical.compact()
+            bm25_s += time.perf_counter() - tl
+            n_lex = len(chunks)
+            # the new snapshot only covers what is embedded; vecs rows past n_vec are never shared
+            if not self._publish(gen, list(chunks), list(pages), vecs[:n_vec] if embed else None, lexical,
+                                 final=last):
+                return False
+            progress(p + 1, n_pages, len(chunks), last)
 
+        if n_pages == 0:
+            progress(0, 0, 0, True)
+        self.last_ingest = {
+            "chunks": len(chunks),
+            "pages": n_pages,
+            "embed_s": embed_s,
+            "chunks_per_s": len(chunks) / embed_s if embed_s > 0 else 0.0,
+            "bm25_ms": bm25_s * 1000.0,
+            "batch_size": self.embed_batch_size,
+            "cached": False,
+            "total_s": time.perf_counter() - t0,
+        }
+        if key is not None and chunks:
+            self.index_cache.save(key, chunks, pages, vecs[:n_vec])
         return True
 
     @staticmethod
@@ -63,19 +231,27 @@ class DocumentStore:
         return out
 
     def retrieve(self, query: str, k: int = 4) -> List[Tuple[str, int, float]]:
-        if not self.chunks:
+        chunks, pages, vecs, index, lexical = self._index
+        if not chunks:
+            return []
+        if lexical is not None and lexical.n_docs != len(chunks):
+            lexical = None
+        mode = self.retrieval
+        qv = None
+        if mode != "bm25" or lexical is None:
+            qv = self.embedder.encode(query) if self.embedder.model is not None else None
+
+        if qv is not None and vecs is not None and vecs.shape[0] == len(chunks):
+            if index is None or index.size != vecs.shape[0]:
+                index = FlatIndex(vecs)
+            if mode == "hybrid" and lexical is not None:
+                depth = k * self.FUSE_DEPTH
+                idx, sims = rrf_fuse([index.search(qv, depth)[0], lexical.search(query, depth)[0]], k)
+            else:
+                idx, sims = index.search(qv, k)
+            return [(chunks[int(i)], pages[int(i)], float(s)) for i, s in zip(idx, sims)]
+
+        if lexical is None:
             return []
-        qv = self.embedder.encode(query) if self.embedder.model is not None else None
-
-        if qv is not None and self.vecs is not None and self.vecs.shape[0] == len(self.chunks):
-            sims = self.vecs @ qv
-            idx = np.argsort(-sims)[:k]
-            return [(self.chunks[int(i)], self.pages[int(i)], float(sims[int(i)])) for i in idx]
-
-        q = query.lower()
-        scored = []
-        for c, p in zip(self.chunks, self.pages):
-            score = sum(1 for w in q.split() if w in c.lower())
-            scored.append((c, p, float(score)))
-        scored.sort(key=lambda x: x[2], reverse=True)
-        return scored[:k]
+        idx, scores = lexical.search(query, k)
+        return [(chunks[int(i)], pages[int(i)], float(s)) for i, s in zip(idx, scores)]
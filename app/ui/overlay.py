@@ -19,18 +19,30 @@ class OverlayUI:
         )
         self.label.pack(padx=10, pady=8)
 
+        # small status lines under the suggestion (audio health, PDF indexing); hidden while empty
+        self.footer = tk.Label(self.win, text="", fg="#c8a040", bg="black", justify="left",
+                               font=("Segoe UI", 10), wraplength=520)
+
         self._clickthrough_enabled = False
         self.visible = True
 
     def apply_style(self, alpha: float, font_size: int, x: int, y: int, clickthrough: bool):
         self.win.attributes("-alpha", max(0.12, min(0.95, alpha)))
         self.label.config(font=("Segoe UI", font_size, "bold"))
+        self.footer.config(font=("Segoe UI", max(8, font_size // 2)))
         self.win.geometry(f"+{x}+{y}")
         self.set_clickthrough(clickthrough)
 
     def set_text(self, text: str):
         self.label.config(text=text)
 
+    def set_footer(self, text: str):
+        self.footer.config(text=text)
+        if text and not self.footer.winfo_ismapped():
+            self.footer.pack(padx=10, pady=(0, 6), anchor="w")
+        elif not text:
+            self.footer.pack_forget()
+
     def set_clickthrough(self, enabled: bool):
         try:
             hwnd = self.win.winfo_id()
@@ -0,0 +1,29 @@
+import threading
+
+class CancelToken:
+    """Cooperative cancellation flag shared between the pipeline and a running ASR/LLM job."""
+    def __init__(self):
+        self._ev = threading.Event()
+
+    def cancel(self):
+        self._ev.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._ev.is_set()
+
+class CancelStats:
+    """Aborted jobs and the CPU time they were estimated to save (thread-safe)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.saved_ms = 0.0
+
+    def record(self, saved_ms: float):
+        with self._lock:
+            self.jobs += 1
+            self.saved_ms += max(0.0, saved_ms)
+
+    def as_dict(self):
+        with self._lock:
+            return {"jobs": self.jobs, "saved_ms": self.saved_ms}
@@ -4,6 +4,7 @@ from dataclasses import dataclass, asdict
 from typing import Optional
 
 CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "config.json")
+DOC_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "doc_cache")
 
 @dataclass
 class AppConfig:
@@ -13,22 +14,53 @@ class AppConfig:
 
     asr_model_size: str = "tiny.en"
     asr_compute_type: str = "int8"
+    asr_threads: int = 0  # 0 = all cores
+    # Optional fast model for partial drafts; empty = one model for partials and finals
+    asr_draft_model_size: str = ""
+    asr_draft_compute_type: str = "int8"
+    asr_draft_threads: int = 2
+    asr_streaming: bool = True
+    asr_batch_window_ms: int = 30
+    asr_max_batch: int = 4
+
+    event_queue_size: int = 16
+    event_queue_policy: str = "drop_oldest"  # drop_oldest / drop_newest / block
+    # a HER partial is coached again only after this many characters changed
+    transcript_min_edit: int = 3
 
     enable_translation: bool = False
     enable_document: bool = False
     cite_document: bool = True
     pdf_path: str = ""
+    doc_embed_batch: int = 32  # chunks per embedding forward pass
+    doc_cache_dir: str = ""    # on-disk index cache; empty = doc_cache/ next to config.json
+    doc_index: str = "auto"    # vector index: flat / ivf / auto (ivf for large documents)
+    # IVF lists searched per query; 0 = automatic (a third of the lists). Fewer is faster
+    # but loses some of the true nearest chunks (recall@5 ~0.8 at a tenth, 100k chunks)
+    doc_ivf_probe: int = 0
+    doc_retrieval: str = "vector"  # vector / bm25 / hybrid (rank fusion of vector and BM25)
 
     llm_model_path: str = ""
     llm_ctx: int = 2048
     llm_threads: int = 4
 
+    coach_cache_size: int = 64  # 0 = no suggestion cache
+    coach_cache_ttl_s: float = 30.0
+    # a final this close (in characters) to the last draft reuses the draft suggestion
+    coach_promote_max_edit: int = 6
+    # fold turns that fall out of the prompt into a summary while the LLM is idle
+    coach_summarize: bool = True
+    coach_summary_idle_s: float = 1.5
+
     overlay_alpha: float = 0.28
     overlay_font_size: int = 18
     overlay_pos_x: int = 80
     overlay_pos_y: int = 80
     overlay_click_through: bool = True
 
+    # pipeline counters (queues, caches, latencies, prompt tokens) as JSON on stderr; 0 = off
+    stats_log_s: float = 60.0
+
     profile_context: str = "My name is Gabriel. I work in IT / Cloud / IoT."
     goal_context: str = "Have a smooth professional conversation in English."
 
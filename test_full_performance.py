@@ -24,12 +24,14 @@ from typing import Dict, Any, List
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'app'))
 
 from app.utils.config import load_config
-from app.asr.whisper_asr import ASREngine
+from app.asr.whisper_asr import ASREngine, StreamingTranscriber
 from app.llm.llm_engine import LLMEngine
 from app.coach.embedder import Embedder
 from app.coach.translator import TranslatorENES
 from app.rag.pdf_store import DocumentStore
 from app.coach.coach import Coach
+from app.rag.vector_index import FlatIndex, IVFIndex
+from app.rag.bm25 import BM25Index
 
 DEFAULT_CFG = os.path.join(os.path.dirname(__file__), "config.default.json")
 
@@ -125,6 +127,131 @@ def test_asr_performance(asr: ASREngine, audio_samples: Dict[str, np.ndarray]) -
     return results
 
 
+def test_asr_batching(asr: ASREngine, audio_samples: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Compare sequential vs batched transcription of segments that are ready together."""
+    print("\n" + "="*80)
+    print("TEST 1b: ASR Batching (mic + loopback ready together)")
+    print("="*80)
+
+    results = {"tests": []}
+    if not asr.ready:
+        print("❌ ASR not ready - cannot test")
+        return results
+
+    segment = audio_samples["short_question"]
+    for batch_size in (2, 4):
+        batch = [segment.copy() for _ in range(batch_size)]
+        asr.transcribe_batch(batch)  # warmup
+
+        t0 = time.time()
+        for a in batch:
+            asr.transcribe(a)
+        seq_s = time.time() - t0
+
+        t0 = time.time()
+        asr.transcribe_batch(batch)
+        batch_s = time.time() - t0
+
+        test_result = {
+            "batch_size": batch_size,
+            "sequential_seg_per_s": batch_size / seq_s,
+            "batched_seg_per_s": batch_size / batch_s,
+        }
+        results["tests"].append(test_result)
+        print(f"\n📊 Batch of {batch_size} x {len(segment) / 16000.0:.1f}s")
+        print(f"   Sequential: {test_result['sequential_seg_per_s']:.2f} seg/s")
+        print(f"   Batched:    {test_result['batched_seg_per_s']:.2f} seg/s")
+
+    return results
+
+
+def test_asr_streaming(asr: ASREngine, audio_samples: Dict[str, np.ndarray],
+                       step_s: float = 0.5) -> Dict[str, Any]:
+    """Streaming (committed prefix) vs full re-decode of a growing segment: CPU and final latency."""
+    print("\n" + "="*80)
+    print("TEST 1d: Streaming ASR vs full re-decode")
+    print("="*80)
+
+    results = {}
+    if not asr.ready:
+        print("❌ ASR not ready - cannot test")
+        return results
+
+    audio = audio_samples["long_question"]
+    step = int(step_s * 16000)
+    cuts = list(range(step, len(audio), step))
+    asr.transcribe(audio[:16000])  # warmup
+
+    # full: every partial and the final transcribe the segment from the start
+    t0 = time.time()
+    for n in cuts:
+        asr.transcribe(audio[:n])
+    full_partials_s = time.time() - t0
+    t0 = time.time()
+    asr.transcribe(audio)
+    full_final_s = time.time() - t0
+
+    # streaming: partials decode the uncommitted tail (with word timestamps), the final only the rest
+    streamer = StreamingTranscriber(asr)
+    t0 = time.time()
+    for n in cuts:
+        streamer.partial("utt", audio[:n])
+    stream_partials_s = time.time() - t0
+    t0 = time.time()
+    streamer.final("utt", audio)
+    stream_final_s = time.time() - t0
+
+    st = streamer.stats()
+    results = {
+        "audio_s": len(audio) / 16000.0,
+        "partials": len(cuts),
+        "full_total_s": full_partials_s + full_final_s,
+        "full_final_ms": full_final_s * 1000,
+        "streaming_total_s": stream_partials_s + stream_final_s,
+        "streaming_final_ms": stream_final_s * 1000,
+        "decoded_ratio": st["decoded_ratio"],
+    }
+    print(f"\n📊 {results['audio_s']:.1f}s segment, partial every {step_s:.1f}s ({len(cuts)} partials)")
+    print(f"   Full re-decode: {results['full_total_s'] * 1000:.0f}ms total, final {results['full_final_ms']:.0f}ms")
+    print(f"   Streaming:      {results['streaming_total_s'] * 1000:.0f}ms total, final {results['streaming_final_ms']:.0f}ms")
+    print(f"   Audio decoded:  {st['decoded_ratio'] * 100:.0f}% of full re-decode")
+
+    return results
+
+
+def test_asr_tiers(cfg, final_asr: ASREngine, audio_samples: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """RTF of the draft (partials) and final tiers when asr_draft_model_size is set."""
+    print("\n" + "="*80)
+    print("TEST 1c: Two-tier ASR (draft vs final model)")
+    print("="*80)
+
+    results = {"tiers": {}}
+    if not cfg.asr_draft_model_size:
+        print("   ⚠️  asr_draft_model_size not set - single tier, skipping")
+        return results
+
+    draft_asr = ASREngine(cfg.asr_draft_model_size, cfg.asr_draft_compute_type, cpu_threads=cfg.asr_draft_threads)
+    audio = audio_samples["long_question"]
+    audio_duration = len(audio) / 16000.0
+
+    for tier, engine in (("draft", draft_asr), ("final", final_asr)):
+        if not engine.ready:
+            print(f"   ❌ {tier} model not ready")
+            continue
+        engine.transcribe(audio[:16000])  # warmup
+        times = []
+        for _ in range(3):
+            t0 = time.time()
+            engine.transcribe(audio)
+            times.append(time.time() - t0)
+        rtf = float(np.mean(times)) / audio_duration
+        results["tiers"][tier] = {"model": engine.model_size, "threads": engine.cpu_threads, "rtf": rtf}
+        print(f"\n📊 {tier}: {engine.model_size} (threads={engine.cpu_threads or 'all'})")
+        print(f"   ⏱️  Average: {np.mean(times) * 1000:.0f}ms (RTF: {rtf:.2f}x)")
+
+    return results
+
+
 def test_llm_performance(llm: LLMEngine) -> Dict[str, Any]:
     """Test LLM performance with different prompt lengths."""
     print("\n" + "="*80)
@@ -191,6 +318,7 @@ def test_llm_performance(llm: LLMEngine) -> Dict[str, Any]:
         
         # Measure
         times = []
+        first_word = []
         responses = []
         for i in range(3):
             t0 = time.time()
@@ -198,13 +326,15 @@ def test_llm_performance(llm: LLMEngine) -> Dict[str, Any]:
                 response = llm.generate_json(
                     test_case["system"],
                     test_case["user"],
-                    max_tokens=test_case["max_tokens"]
+                    max_tokens=test_case["max_tokens"],
+                    on_say_now=lambda _say: None
                 )
                 t1 = time.time()
                 elapsed = (t1 - t0) * 1000  # ms
                 times.append(elapsed)
+                first_word.append(llm.first_say_ms)
                 responses.append(response)
-                print(f"   Run {i+1}: {elapsed:.0f}ms")
+                print(f"   Run {i+1}: {elapsed:.0f}ms (first word: {llm.first_say_ms:.0f}ms)")
             except Exception as e:
                 print(f"   Run {i+1}: ERROR - {e}")
                 times.append(-1)
@@ -226,12 +356,13 @@ def test_llm_performance(llm: LLMEngine) -> Dict[str, Any]:
             "avg_latency_ms": avg_time,
             "min_latency_ms": min_time,
             "max_latency_ms": max_time,
+            "avg_first_word_ms": np.mean(first_word) if first_word else -1,
             "sample_response": responses[0] if responses else {}
         }
         results["tests"].append(test_result)
         
         if avg_time > 0:
-            print(f"   ⏱️  Average: {avg_time:.0f}ms")
+            print(f"   ⏱️  Average: {avg_time:.0f}ms (first word: {test_result['avg_first_word_ms']:.0f}ms)")
             print(f"   📝 Response: {json.dumps(responses[0], indent=2)}")
             
             # Status
@@ -399,13 +530,7 @@ def test_document_feature(docstore: DocumentStore, embedder: Embedder) -> Dict[s
         
         # Embed mock chunks
         if embedder.model is not None:
-            vec_list = []
-            for c in docstore.chunks:
-                v = embedder.encode(c)
-                if v is not None:
-                    vec_list.append(v)
-            if vec_list:
-                docstore.vecs = np.stack(vec_list, axis=0)
+            docstore.vecs = embedder.encode_many(docstore.chunks, cache=False)
         
         results["pdf_loaded"] = True
         results["chunks_count"] = len(mock_chunks)
@@ -446,10 +571,140 @@ def test_document_feature(docstore: DocumentStore, embedder: Embedder) -> Dict[s
             })
         
         results["retrieval_test"] = retrieval_results
+
+        # the same queries again: every query embedding now comes from the cache
+        t0 = time.time()
+        for query in test_queries:
+            docstore.retrieve(query, k=2)
+        cached_ms = (time.time() - t0) * 1000 / len(test_queries)
+        results["embedding_cache"] = dict(embedder.stats(), cached_retrieval_ms=cached_ms)
+        print(f"\n   ♻️  Cached retrieval: {cached_ms:.1f}ms/query "
+              f"(embedding cache hit rate {results['embedding_cache']['hit_rate']:.0%})")
     
     return results
 
 
+def test_embedding_throughput(embedder: Embedder, n_chunks: int = 128) -> Dict[str, Any]:
+    """Chunk embedding throughput: one chunk per forward pass vs length-bucketed batches."""
+    print("\n" + "="*80)
+    print("TEST 4b: Document Chunk Embedding Throughput")
+    print("="*80)
+
+    results = {"tests": []}
+    if embedder.model is None:
+        print("❌ Embedder not available - cannot test")
+        return results
+
+    # PDF-like chunks of uneven length (up to the 1400-char chunk size)
+    rng = np.random.default_rng(0)
+    words = "the system supports loading documents for retrieval during live conversations".split()
+    chunks = [" ".join(rng.choice(words, size=int(rng.integers(20, 230)))) for _ in range(n_chunks)]
+    out = np.empty((n_chunks, embedder.dim), dtype=np.float32)
+
+    for batch_size in (1, 8, 32, 64):
+        t0 = time.time()
+        embedder.encode_into(chunks, out=out, batch_size=batch_size)
+        elapsed = time.time() - t0
+        rate = n_chunks / elapsed if elapsed > 0 else 0.0
+        results["tests"].append({"batch_size": batch_size, "chunks_per_s": rate})
+        print(f"   batch={batch_size:<3} {rate:7.1f} chunks/s")
+
+    return results
+
+
+def test_vector_index(sizes=(1000, 10000, 100000), dim: int = 384, k: int = 5,
+                      n_queries: int = 100) -> Dict[str, Any]:
+    """Flat vs IVF vector search: build time, query latency and recall@k vs exact search."""
+    print("\n" + "="*80)
+    print("TEST 4c: Vector Index (flat vs IVF)")
+    print("="*80)
+
+    rng = np.random.default_rng(0)
+    results = {"tests": []}
+    for n in sizes:
+        # clustered unit vectors, roughly like chunk embeddings of related documents
+        centers = rng.standard_normal((max(10, n // 100), dim)).astype(np.float32)
+        vecs = centers[rng.integers(0, centers.shape[0], n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+        vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+        queries = vecs[rng.integers(0, n, n_queries)] + 0.3 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        flat = FlatIndex(vecs)
+        t0 = time.time()
+        ivf = IVFIndex(vecs)
+        build_s = time.time() - t0
+
+        flat_ms, ivf_ms, hits = [], [], 0
+        for q in queries:
+            t0 = time.time()
+            exact = flat.search(q, k)[0]
+            flat_ms.append((time.time() - t0) * 1000)
+            t0 = time.time()
+            approx = ivf.search(q, k)[0]
+            ivf_ms.append((time.time() - t0) * 1000)
+            hits += len(set(exact.tolist()) & set(approx.tolist()))
+
+        test_result = {
+            "chunks": n,
+            "flat_ms": float(np.mean(flat_ms)),
+            "ivf_ms": float(np.mean(ivf_ms)),
+            "ivf_build_s": build_s,
+            "ivf_lists": ivf.n_lists,
+            "ivf_probe": ivf.n_probe,
+            f"recall_at_{k}": hits / (k * n_queries),
+        }
+        results["tests"].append(test_result)
+        print(f"\n📊 {n} chunks (IVF: {ivf.n_lists} lists, probe {ivf.n_probe}, build {build_s:.2f}s)")
+        print(f"   Flat: {test_result['flat_ms']:.2f}ms/query")
+        print(f"   IVF:  {test_result['ivf_ms']:.2f}ms/query, recall@{k} {test_result[f'recall_at_{k}']:.2f}")
+
+    return results
+
+
+def test_lexical_index(sizes=(1000, 10000), k: int = 5, n_queries: int = 100) -> Dict[str, Any]:
+    """BM25 inverted index vs the old substring scan: build time and query latency."""
+    print("\n" + "="*80)
+    print("TEST 4d: Lexical Index (BM25 vs keyword scan)")
+    print("="*80)
+
+    rng = np.random.default_rng(0)
+    vocab = [f"term{i}" for i in range(5000)] + ["AWS", "IoT", "Kubernetes", "Wi-Fi", "v2.1", "MQTT"]
+    results = {"tests": []}
+    for n in sizes:
+        # ~200-word chunks with a Zipf-like word distribution
+        words = np.minimum(rng.zipf(1.3, size=(n, 200)) - 1, len(vocab) - 1)
+        chunks = [" ".join(vocab[w] for w in row) for row in words]
+        queries = [" ".join(vocab[w] for w in rng.integers(0, len(vocab), 3)) for _ in range(n_queries)]
+
+        t0 = time.time()
+        index = BM25Index().add(chunks).compact()
+        build_s = time.time() - t0
+
+        bm25_ms, scan_ms = [], []
+        for q in queries:
+            t0 = time.time()
+            index.search(q, k)
+            bm25_ms.append((time.time() - t0) * 1000)
+        for q in queries[:10]:
+            t0 = time.time()
+            scored = sorted(((sum(1 for w in q.lower().split() if w in c.lower()), i)
+                             for i, c in enumerate(chunks)), reverse=True)[:k]
+            scan_ms.append((time.time() - t0) * 1000)
+
+        test_result = {
+            "chunks": n,
+            "bm25_build_s": build_s,
+            "bm25_ms": float(np.mean(bm25_ms)),
+            "scan_ms": float(np.mean(scan_ms)),
+        }
+        results["tests"].append(test_result)
+        print(f"\n📊 {n} chunks (BM25 build {build_s:.2f}s)")
+        print(f"   BM25: {test_result['bm25_ms']:.3f}ms/query")
+        print(f"   Scan: {test_result['scan_ms']:.2f}ms/query")
+
+    return results
+
+
 def test_context_feature(cfg) -> Dict[str, Any]:
     """Test initial context configuration feature."""
     print("\n" + "="*80)
@@ -494,6 +749,11 @@ def print_summary(all_results: Dict[str, Any]):
         for test in asr_tests:
             print(f"   - {test['name']}: {test['avg_latency_ms']:.0f}ms (RTF: {test['rtf']:.2f}x)")
     
+    if "asr_tiers" in all_results and all_results["asr_tiers"]["tiers"]:
+        print("\n📊 ASR RTF per tier:")
+        for tier, info in all_results["asr_tiers"]["tiers"].items():
+            print(f"   - {tier} ({info['model']}): RTF {info['rtf']:.2f}x")
+    
     # LLM Summary
     if "llm" in all_results and all_results["llm"]["tests"]:
         llm_tests = all_results["llm"]["tests"]
@@ -570,7 +830,7 @@ def main():
     print("\n🔧 Initializing components...")
     
     print("   Loading ASR model...")
-    asr = ASREngine(cfg.asr_model_size, cfg.asr_compute_type)
+    asr = ASREngine(cfg.asr_model_size, cfg.asr_compute_type, cpu_threads=cfg.asr_threads)
     if asr.ready:
         print(f"   ✅ ASR ready ({cfg.asr_model_size})")
     else:
@@ -597,7 +857,7 @@ def main():
     print(f"   ✅ Translator ready")
     
     print("   Loading document store...")
-    docstore = DocumentStore(embedder)
+    docstore = DocumentStore(embedder, embed_batch_size=cfg.doc_embed_batch)
     print(f"   ✅ Document store ready")
     
     if llm and llm.ready:
@@ -629,6 +889,9 @@ def main():
     # Test 1: ASR
     if asr.ready:
         all_results["asr"] = test_asr_performance(asr, audio_samples)
+        all_results["asr_batching"] = test_asr_batching(asr, audio_samples)
+        all_results["asr_streaming"] = test_asr_streaming(asr, audio_samples)
+        all_results["asr_tiers"] = test_asr_tiers(cfg, asr, audio_samples)
     
     # Test 2: LLM
     if llm and llm.ready:
@@ -640,6 +903,9 @@ def main():
     
     # Test 4: Document Feature
     all_results["document"] = test_document_feature(docstore, embedder)
+    all_results["embedding_throughput"] = test_embedding_throughput(embedder)
+    all_results["vector_index"] = test_vector_index()
+    all_results["lexical_index"] = test_lexical_index()
     
     # Test 5: Context Feature
     all_results["context"] = test_context_feature(cfg)
@@ -326,6 +326,191 @@ def create_usage_guide():
     print("   python test_full_performance.py")
     print("   (Requires models to be downloaded)")
 
+class _FakeLLM:
+    """Stands in for LLMEngine: answers every prompt, counts calls."""
+    n_ctx = 2048
+
+    def __init__(self):
+        self.calls = 0
+        self.turns = []
+        self.on_evict = None
+        self.turn_budget = None
+        self.last_prompt_tokens = 0
+
+    def count_tokens(self, text):
+        return len(text) // 4 + 1
+
+    def clear_turns(self):
+        self.turns = []
+
+    def append_turn(self, text):
+        self.turns.append(text)
+
+    def turn_tokens(self):
+        return sum(self.count_tokens(t) for t in self.turns)
+
+    def generate_json(self, system, user, **kwargs):
+        self.calls += 1
+        return {"say_now": f"reply {self.calls}", "intent": "answer", "must_include": []}
+
+def test_coach_cache():
+    """A retried final is answered from the suggestion cache."""
+    print_header("TEST 6: Suggestion Cache")
+
+    from types import SimpleNamespace
+    from app.coach.coach import Coach
+
+    llm = _FakeLLM()
+    embedder = SimpleNamespace(model=None, encode=lambda text: None)  # no topic tracking
+    coach = Coach("profile", "goal", False, False, False, llm, embedder, None, None, summarize=False)
+
+    first = coach.suggest_final("What are you working on?")
+    again = coach.suggest_final("What are you working on?")
+    stats = coach.cache.stats()
+    assert again == first and llm.calls == 1, "retried final was not served from the cache"
+    assert stats["hits"] == 1, stats
+    assert len(coach.history) == 1, "retried final was added as a new turn"
+
+    print(f"\n✅ Identical finals: 1 LLM call, {stats['hits']} cache hit")
+    return stats
+
+def test_segment_ring():
+    """Zero-copy segment leases: no reuse while leased, private fallback, idempotent release."""
+    print_header("TEST 7: Segment Ring Leases")
+
+    from app.audio.ring import SegmentRing
+
+    ring = SegmentRing(max_len=100, slots=2)
+    held = []
+    for cycle in range(4):
+        ring.begin()
+        ring.append(np.full(60, cycle, dtype=np.float32))
+        held.append((cycle, ring.lease()))
+        ring.close()
+    # two regions fit; with both still leased the later segments use private buffers
+    assert ring.stats()["overflows"] == 2, ring.stats()
+    for cycle, seg in held:
+        assert seg.size == 60 and np.all(seg.audio() == cycle), f"segment {cycle} was overwritten"
+
+    # a lease taken mid-segment keeps its length while the segment grows
+    ring.begin()
+    ring.append(np.ones(10, dtype=np.float32))
+    early = ring.lease()
+    ring.append(np.ones(10, dtype=np.float32))
+    ring.close()
+    assert early.size == 10
+    early.release()
+
+    for _, seg in held:
+        seg.release()
+        seg.release()  # a second release does nothing
+    assert ring.stats()["live_segments"] == 0, ring.stats()
+
+    # random lengths and lease lifetimes: held data is never overwritten
+    rng = np.random.default_rng(0)
+    ring = SegmentRing(max_len=50, slots=4)
+    held = []
+    for cycle in range(500):
+        ring.begin()
+        n = int(rng.integers(1, 51))
+        ring.append(np.full(n, cycle, dtype=np.float32))
+        held.append((cycle, n, ring.lease()))
+        ring.close()
+        for item in [h for h in held if rng.random() < 0.4]:
+            item[2].release()
+            held.remove(item)
+        for c, n, seg in held:
+            assert seg.size == n and np.all(seg.audio() == c), f"segment {c} was overwritten"
+    for _, _, seg in held:
+        seg.release()
+    assert ring.stats()["live_segments"] == 0, ring.stats()
+
+    print(f"\n✅ Leases intact over 500 cycles ({ring.stats()['overflows']} private-buffer fallbacks)")
+    return ring.stats()
+
+def test_event_queue():
+    """Coalescing and full-queue policies of the audio EventQueue."""
+    print_header("TEST 8: Event Queue Coalescing")
+
+    import queue
+    import threading
+    import time
+    from app.audio.ring import SegmentRing
+    from app.pipeline.event_queue import EventQueue, release_event
+
+    ring = SegmentRing(max_len=10, slots=4)
+
+    def ev(source, kind, utt):
+        ring.begin()
+        ring.append(np.zeros(5, dtype=np.float32))
+        seg = ring.lease()
+        ring.close()
+        return {"source": source, "kind": kind, "utt": utt, "segment": seg}
+
+    def drain(q):
+        out = []
+        while not q.empty():
+            e = q.get_nowait()
+            release_event(e)
+            out.append((e["source"], e["kind"], e["utt"]))
+        return out
+
+    # a newer partial replaces the queued partial of its source, in place
+    q = EventQueue(8)
+    q.put(ev("her", "partial", 1))
+    q.put(ev("me", "partial", 7))
+    q.put(ev("her", "partial", 2))
+    assert drain(q) == [("her", "partial", 2), ("me", "partial", 7)]
+    assert q.stats()["coalesced"] == 1
+
+    # a final drops queued partials of its own utterance only
+    q = EventQueue(8)
+    q.put(ev("me", "partial", 1))
+    q.put(ev("her", "final", 1))
+    q.put(ev("her", "partial", 2))
+    q.put(ev("her", "final", 2))
+    assert drain(q) == [("me", "partial", 1), ("her", "final", 1), ("her", "final", 2)]
+    assert q.stats()["cancelled"] == 1
+
+    # drop_oldest: evicts the oldest partial, or the oldest event if there is none
+    q = EventQueue(2, "drop_oldest")
+    q.put(ev("her", "final", 1))
+    q.put(ev("me", "partial", 2))
+    q.put(ev("her", "final", 3))
+    assert drain(q) == [("her", "final", 1), ("her", "final", 3)]
+    q.put(ev("her", "final", 1))
+    q.put(ev("me", "final", 2))
+    q.put(ev("her", "final", 3))
+    assert drain(q) == [("me", "final", 2), ("her", "final", 3)]
+
+    # drop_newest: the incoming event is rejected
+    q = EventQueue(1, "drop_newest")
+    q.put(ev("her", "final", 1))
+    q.put(ev("her", "final", 2))
+    assert drain(q) == [("her", "final", 1)] and q.stats()["dropped"] == 1
+
+    # block: waits for room, gives up after the timeout, never waits with block=False
+    q = EventQueue(1, "block")
+    q.put(ev("her", "final", 1))
+    q.put(ev("her", "final", 2), block=False)
+    q.put(ev("her", "final", 3), timeout=0.05)
+    assert q.stats()["dropped"] == 2
+    threading.Timer(0.05, lambda: release_event(q.get_nowait())).start()
+    t0 = time.time()
+    q.put(ev("her", "final", 4), timeout=2.0)
+    assert time.time() - t0 < 1.0 and drain(q) == [("her", "final", 4)]
+
+    # every discarded event released its segment
+    assert ring.stats()["live_segments"] == 0, ring.stats()
+    try:
+        q.get(timeout=0.01)
+        raise AssertionError("empty queue returned an event")
+    except queue.Empty:
+        pass
+
+    print("\n✅ Partials coalesce, finals cancel their own partials, all policies behave")
+    return q.stats()
+
 def main():
     """Main test execution."""
     print("="*80)
@@ -355,6 +540,18 @@ def main():
     # Test 5: Usage
     create_usage_guide()
     results["usage"] = "✅ EXPLAINED"
+
+    # Test 6: Suggestion cache
+    test_coach_cache()
+    results["coach_cache"] = "✅ PASSED"
+
+    # Test 7: Segment ring
+    test_segment_ring()
+    results["segment_ring"] = "✅ PASSED"
+
+    # Test 8: Event queue
+    test_event_queue()
+    results["event_queue"] = "✅ PASSED"
     
     # Summary
     print_header("SUMMARY")